@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Fade masks with different falloff profiles.
+
+radial_mask of the exercise fades linearly with the distance from the center
+of the image. The masks here generalize it with:
+
+- falloff profiles: linear, gamma, Gaussian or a custom function
+- circular or elliptical falloff, where the elliptical one follows the aspect
+  ratio of the image
+- an arbitrary center point
+- a value range [tmin, tmax]
+
+All profiles are computed from the same normalized squared distance field,
+which only depends on the geometry: the image size, the center and the shape
+of the falloff. The field is cached, so that switching between profiles or
+their parameters does not recompute the geometry.
+"""
+
+from functools import lru_cache
+from typing import Callable, Tuple, Union
+
+import numpy as np
+
+from radial_fade import center
+
+
+@lru_cache(maxsize=16)
+def squared_distance_field(height: int, width: int,
+                           center_point: Tuple[float, float] = None,
+                           elliptical: bool = False) -> np.array:
+    """
+    Returns the squared distance of each cell of an array from a center point,
+    normalized so that the farthest cell has the value 1.
+
+    With elliptical=True, the y and x distances are first divided by the
+    largest y and x distance from the center to an edge of the array, so that
+    the contours of the field are ellipses with the aspect ratio of the array
+    instead of circles.
+
+    The fields of the most recently used geometries are cached. The returned
+    array is read-only, since it is shared between the calls.
+
+    Parameters:
+    - height: Height of the array
+    - width: Width of the array
+    - center_point: (center_y, center_x) of the field, by default the center
+        of the array, see center
+    - elliptical: Whether the contours are ellipses instead of circles
+
+    Returns:
+    - field: Read-only float32 Numpy array with shape (height, width) and
+        values between 0 and 1
+    """
+    center_y, center_x = center_point or \
+        center(np.broadcast_to(0, (height, width)))
+
+    dy = np.arange(height) - center_y
+    dx = np.arange(width) - center_x
+
+    if elliptical:
+        dy /= np.abs(dy).max() or 1.0
+        dx /= np.abs(dx).max() or 1.0
+
+    field = (dy**2)[:, None] + (dx**2)[None, :]
+    field /= field.max() or 1.0
+
+    field = field.astype(np.float32)
+    field.setflags(write=False)
+
+    return field
+
+
+def linear_profile(field: np.array) -> np.array:
+    """
+    Linear falloff 1 - d, where d is the distance scaled to [0, 1] like in
+    radial_mask, so that the mask is 1 at the center even when the center
+    falls between cells.
+    """
+    distance = np.sqrt(field)
+    distance -= distance.min()
+    distance /= distance.max() or 1.0
+
+    return 1 - distance
+
+
+def gamma_profile(field: np.array, gamma: float = 2.0) -> np.array:
+    """
+    Gamma falloff (1 - d) ** gamma, see linear_profile. Values of gamma above
+    1 fade faster near the center, values below 1 slower.
+    """
+    return linear_profile(field) ** gamma
+
+
+def gaussian_profile(field: np.array, sigma: float = 0.5) -> np.array:
+    """
+    Gaussian falloff exp(-d2 / (2 * sigma**2)), where d2 is the normalized
+    squared distance, so no square root is needed.
+    """
+    return np.exp(field / np.float32(-2 * sigma**2))
+
+
+PROFILES = {
+    "linear": linear_profile,
+    "gamma": gamma_profile,
+    "gaussian": gaussian_profile,
+}
+
+
+def falloff_mask(shape: tuple, profile: Union[str, Callable] = "linear",
+                 center_point: Tuple[float, float] = None,
+                 elliptical: bool = False, tmin: float = 0.0,
+                 tmax: float = 1.0, **profile_params) -> np.array:
+    """
+    Returns a fade mask for an array with a given falloff profile.
+
+    The profiles get the normalized squared distance field of
+    squared_distance_field and return a value between 0 (faded) and 1 (not
+    faded) for each cell:
+
+    - "linear": see linear_profile, the same mask as radial_mask
+    - "gamma": see gamma_profile, with the parameter gamma
+    - "gaussian": see gaussian_profile, with the parameter sigma
+
+    A custom profile is a function from the normalized squared distance field
+    to mask values between 0 and 1.
+
+    Parameters:
+    - shape: Shape of the array to mask, only the height and width are used
+    - profile: Name of a profile in PROFILES, or a custom profile function
+    - center_point: (center_y, center_x) of the mask, by default the center
+        of the array
+    - elliptical: Whether the falloff follows the aspect ratio of the array
+    - tmin: Value of the mask where the profile is 0
+    - tmax: Value of the mask where the profile is 1
+    - profile_params: Parameters of the profile, e.g. gamma or sigma
+
+    Returns:
+    - mask: Float32 Numpy array with shape shape[:2] and values between tmin
+        and tmax
+    """
+    field = squared_distance_field(
+        shape[0], shape[1],
+        None if center_point is None else tuple(map(float, center_point)),
+        elliptical)
+
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(
+                f"Unknown profile {profile!r}, expected one of "
+                f"{', '.join(PROFILES)} or a function")
+        profile = PROFILES[profile]
+
+    mask = np.asarray(profile(field, **profile_params), dtype=np.float32)
+
+    return mask * np.float32(tmax - tmin) + np.float32(tmin)
@@ -47,6 +47,9 @@ On top the original painting.png, in the middle the mask, and on the bottom the
 faded image.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Tuple
 
 import numpy as np
@@ -70,51 +73,72 @@ def center(a: np.array) -> Tuple[float, float]:
     return ((a.shape[0] - 1) / 2, (a.shape[1] - 1) / 2)   # note the order: (center_y, center_x)
 
 
-def radial_distance(a: np.array) -> np.array:
+def radial_distance(a: np.array, squared: bool = False,
+                    dtype: type = np.float32) -> np.array:
     """
     Returns the Euclidean distance of each Numpy array cell from the center point of the array.
 
+    The squared distances are the outer sum dy**2 + dx**2 of the squared y and
+    x offsets of the rows and columns, so no coordinate grids are needed. The
+    distances are also symmetric around the center in both directions, so only
+    the top left quadrant is computed, and the square root is taken in place.
+    The other quadrants are mirrored from it.
+
     Parameters:
     - a: Numpy array (should be the same shape as the array to be masked)
+    - squared: Whether to return the squared distances, skipping the square
+        root
+    - dtype: Floating point type of the distances
 
     Returns:
-    - distances: Numpy array of the same shape as a, with Euclidean distances from array
-        center point as values
+    - distances: Numpy array with the height and width of a, with Euclidean
+        distances from array center point as values
     """
 
     # Get center point of array
-    center_point = np.array(center(a))
+    center_y, center_x = center(a)
+    height, width = a.shape[0], a.shape[1]
+
+    # The top left quadrant, including the middle row and column of odd sized
+    # arrays
+    quadrant_height, quadrant_width = (height + 1) // 2, (width + 1) // 2
+    dy = np.arange(quadrant_height, dtype=dtype) - dtype(center_y)
+    dx = np.arange(quadrant_width, dtype=dtype) - dtype(center_x)
+
+    distances = np.empty((height, width), dtype=dtype)
+    quadrant = distances[:quadrant_height, :quadrant_width]
+    np.add((dy * dy)[:, None], (dx * dx)[None, :], out=quadrant)
 
-    # Create arrays with pixel locations for distance calculation,
-    # starting from 0
-    x_coord, y_coord = np.meshgrid(
-        np.arange(a.shape[1]), np.arange(a.shape[0]))
+    if not squared:
+        np.sqrt(quadrant, out=quadrant)
 
-    # Calculate Euclidean distance of each pixel from center point
-    distances = np.sqrt(
-        (y_coord - center_point[0])**2 + (x_coord-center_point[1])**2)
+    # Mirror the quadrant to the right, and the top half to the bottom
+    distances[:quadrant_height, width - quadrant_width:] = quadrant[:, ::-1]
+    distances[height - quadrant_height:] = distances[:quadrant_height][::-1]
 
     return distances
 
 
-def scale(a: np.array) -> np.array:
+def scale(a: np.array, tmin: float = 0.0, tmax: float = 1.0) -> np.array:
     """
     Returns a copy of array 'a' with its values scaled to be in the range
     [tmin,tmax].
 
+    If all values of a are equal, they are all scaled to tmin.
+
     Parameters:
-    a: Numpy array the values of which are to be scaled
-    tmin: Minimum value to which to scale the array values
-    tmax: Maximum values to which to scale the array values
+    - a: Numpy array the values of which are to be scaled
+    - tmin: Minimum value to which to scale the array values
+    - tmax: Maximum values to which to scale the array values
 
     Returns:
-    - a_scales: Copy of array a with values scaled to between tmin and tmax
+    - a_scaled: Copy of array a with values scaled to between tmin and tmax
     """
 
     a_centered = a - np.min(a)
     a_scaled = a_centered / \
         (np.max(a_centered) if np.max(a_centered) > 0 else 1)
-    return a_scaled
+    return a_scaled * (tmax - tmin) + tmin
 
 
 def radial_mask(a: np.array) -> np.array:
@@ -133,7 +157,30 @@ def radial_mask(a: np.array) -> np.array:
     return 1 - scale(radial_distance(a))
 
 
-def radial_fade(a: np.array) -> np.array:
+@lru_cache(maxsize=16)
+def cached_radial_mask(height: int, width: int) -> np.array:
+    """
+    Returns the radial mask of an array with the given height and width as
+    float32, see radial_mask.
+
+    The masks of the most recently used sizes are cached, so that fading many
+    images of the same size computes the mask only once. The returned array is
+    read-only, since it is shared between the calls.
+
+    Parameters:
+    - height: Height of the array
+    - width: Width of the array
+
+    Returns:
+    - mask: Read-only float32 Numpy array with shape (height, width)
+    """
+    mask = radial_mask(np.broadcast_to(0, (height, width))).astype(np.float32)
+    mask.setflags(write=False)
+
+    return mask
+
+
+def radial_fade(a: np.array, out: np.array = None) -> np.array:
     """
     Applies a radial fade mask to a Numpy array (e.g. a picture).
 
@@ -141,19 +188,219 @@ def radial_fade(a: np.array) -> np.array:
     array as measured by Euclidean distance are scaled closer to zero. With a
     picture, this causes a scaling towards black.
 
+    The mask is taken from cached_radial_mask, so it is computed only once for
+    each image size.
+
     Parameters:
     - a: Numpy array to which to apply the radial fade mask.
+    - out: Optional floating point array with the same shape as a, into which
+        the result is written without allocating a new array. Can be a itself
+        to fade in place.
 
     Returns:
     - Numpy array of same shape as a, with values further away from array center
-        scaled towards black
+        scaled towards black. This is out if it was given.
     """
-    mask = radial_mask(a)
+    mask = cached_radial_mask(a.shape[0], a.shape[1])
 
     if len(a.shape) == 3:
-        mask = mask.reshape(mask.shape[0], mask.shape[1], -1)
+        mask = mask[..., None]
+
+    return np.multiply(a, mask, out=out)
+
+
+@lru_cache(maxsize=16)
+def cached_fixed_point_mask(height: int, width: int) -> np.array:
+    """
+    Returns the radial mask of an array with the given height and width in
+    8-bit fixed point, i.e. multiplied by 256 and rounded, as uint16. Cached
+    and read-only like cached_radial_mask.
+
+    Parameters:
+    - height: Height of the array
+    - width: Width of the array
+
+    Returns:
+    - mask: Read-only uint16 Numpy array with shape (height, width) and values
+        between 0 and 256
+    """
+    mask = np.rint(cached_radial_mask(height, width) * 256).astype(np.uint16)
+    mask.setflags(write=False)
+
+    return mask
+
+
+def _fade_frames(frames: np.array, out: np.array, mask: np.array):
+    """
+    Fades a chunk of frames into out in a worker thread of radial_fade_stack.
+    For uint8 frames, the mask is in fixed point and the product is computed
+    in uint16 and rounded back to uint8 without converting to floating point.
+    """
+    if frames.dtype == np.uint8:
+        product = np.multiply(frames, mask, dtype=np.uint16)
+        product += 128
+        product >>= 8
+        out[...] = product
+    else:
+        np.multiply(frames, mask, out=out)
+
+
+def radial_fade_stack(frames: np.array, out: np.array = None,
+                      n_threads: int = None, chunk_frames: int = 1) \
+        -> np.array:
+    """
+    Applies a radial fade mask to each frame of a stack, e.g. of video frames,
+    see radial_fade.
+
+    All frames share one cached mask. The stack is split into chunks of frames
+    that are faded in a pool of threads, which run in parallel since NumPy
+    releases the GIL during the arithmetic.
+
+    uint8 frames are faded in 8-bit fixed point: each pixel is multiplied by
+    the mask times 256 in uint16 and rounded back to uint8 with
+    (pixel * mask + 128) >> 8, so the frames are never converted to floating
+    point. Other frames are multiplied by the float32 mask.
+
+    Parameters:
+    - frames: Numpy array of frames with shape (N, H, W) or (N, H, W, C)
+    - out: Optional array with the same shape as frames into which to write
+        the result, can be frames itself. By default a new array, uint8 for
+        uint8 frames and floating point otherwise.
+    - n_threads: Number of threads, by default the number of CPUs
+    - chunk_frames: Number of frames per chunk
+
+    Returns:
+    - out: The faded frames
+    """
+    if frames.dtype == np.uint8:
+        mask = cached_fixed_point_mask(frames.shape[1], frames.shape[2])
+        out_dtype = np.uint8
+    else:
+        mask = cached_radial_mask(frames.shape[1], frames.shape[2])
+        out_dtype = np.result_type(frames.dtype, np.float32)
 
-    return a * mask
+    if len(frames.shape) == 4:
+        mask = mask[..., None]
+
+    if out is None:
+        out = np.empty(frames.shape, dtype=out_dtype)
+
+    n_threads = n_threads or os.cpu_count()
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        chunks = [slice(start, start + chunk_frames)
+                  for start in range(0, frames.shape[0], chunk_frames)]
+        for future in [executor.submit(_fade_frames, frames[chunk],
+                                       out[chunk], mask)
+                       for chunk in chunks]:
+            future.result()
+
+    return out
+
+
+def radial_mask_band(shape: tuple, row_start: int, row_stop: int) \
+        -> np.array:
+    """
+    Returns rows row_start:row_stop of the radial mask of an array with the
+    given shape, without computing the rest of the mask.
+
+    The distances of the band are computed from the center of the array, and
+    they are scaled with the smallest and largest distance of the whole array,
+    which are known analytically: the largest distance is from the center to a
+    corner, and the smallest one is from the center to the nearest pixel,
+    which is less than one pixel away in each direction.
+
+    Parameters:
+    - shape: Shape of the whole array
+    - row_start: First row of the band
+    - row_stop: Row after the last row of the band
+
+    Returns:
+    - mask: Float32 Numpy array with shape (row_stop - row_start, shape[1])
+    """
+    center_y, center_x = center(np.broadcast_to(0, shape[:2]))
+
+    dy = np.arange(row_start, row_stop) - center_y
+    dx = np.arange(shape[1]) - center_x
+    distances = np.sqrt(dy[:, None]**2 + dx[None, :]**2)
+
+    min_distance = np.hypot(center_y % 1, center_x % 1)
+    max_distance = np.hypot(center_y, center_x)
+    distance_range = max_distance - min_distance
+
+    return (1 - (distances - min_distance) /
+            (distance_range if distance_range > 0 else 1)).astype(np.float32)
+
+
+def radial_fade_tiled(a: np.array, out: np.array = None,
+                      band_pixels: int = 2**20) -> np.array:
+    """
+    Applies a radial fade mask to an array in bands of rows, see radial_fade.
+
+    Only one band of the mask and the image is in memory at a time, and the
+    number of rows in a band is chosen so that the bands have about the same
+    number of pixels regardless of the width of the image. With a and out as
+    memory-mapped arrays, the peak memory use thus does not depend on the size
+    of the image.
+
+    Parameters:
+    - a: Numpy array, e.g. a memory-mapped array, to which to apply the radial
+        fade mask
+    - out: Array with the same shape as a into which to write the result, by
+        default a new float32 array
+    - band_pixels: Approximate number of pixels to process at a time
+
+    Returns:
+    - out: The faded array
+    """
+    if out is None:
+        out = np.empty(a.shape, dtype=np.float32)
+
+    band_rows = max(1, band_pixels // max(a.shape[1], 1))
+
+    for row_start in range(0, a.shape[0], band_rows):
+        row_stop = min(row_start + band_rows, a.shape[0])
+        mask = radial_mask_band(a.shape, row_start, row_stop)
+
+        if len(a.shape) == 3:
+            mask = mask[..., None]
+
+        np.multiply(a[row_start:row_stop], mask,
+                    out=out[row_start:row_stop], casting="unsafe")
+
+    return out
+
+
+def radial_fade_file(in_path: str, out_path: str, shape: tuple = None,
+                     dtype: str = None, out_dtype: str = "float32",
+                     band_pixels: int = 2**20):
+    """
+    Applies a radial fade mask to an image stored in a file, and writes the
+    result into a .npy file. Both files are memory-mapped and processed with
+    radial_fade_tiled, so images larger than the memory can be faded.
+
+    Parameters:
+    - in_path: Path to a .npy file, or to a raw file of pixel values in row
+        major order
+    - out_path: Path of the .npy file to write
+    - shape: Shape of the image in a raw file, ignored for .npy files
+    - dtype: Data type of the pixel values in a raw file, ignored for .npy
+        files
+    - out_dtype: Data type of the written pixel values. Values are truncated
+        when writing integer types.
+    - band_pixels: Approximate number of pixels to process at a time
+    """
+    if in_path.endswith(".npy"):
+        a = np.load(in_path, mmap_mode="r")
+    else:
+        if shape is None or dtype is None:
+            raise ValueError("shape and dtype are required for raw files")
+        a = np.memmap(in_path, dtype=dtype, mode="r", shape=tuple(shape))
+
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=out_dtype,
+                                    shape=a.shape)
+    radial_fade_tiled(a, out, band_pixels)
+    out.flush()
 
 
 def main():
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the radial fade exercise.
+
+Run from the radial_fade folder like the exercise itself:
+
+    python src/radial_fade_benchmark.py
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from falloff_masks import falloff_mask, squared_distance_field
+from radial_fade import (cached_radial_mask, center, radial_distance,
+                         radial_fade, radial_fade_file, radial_fade_stack,
+                         radial_mask)
+
+
+def radial_fade_uncached(a: np.array) -> np.array:
+    """
+    The original implementation of radial_fade, which computes the mask on
+    every call, kept as the baseline for benchmarking.
+    """
+    mask = radial_mask(a)
+
+    if len(a.shape) == 3:
+        mask = mask.reshape(mask.shape[0], mask.shape[1], -1)
+
+    return a * mask
+
+
+def radial_distance_meshgrid(a: np.array) -> np.array:
+    """
+    The original implementation of radial_distance with full coordinate grids
+    from np.meshgrid, kept as the baseline for benchmarking.
+    """
+    center_point = np.array(center(a))
+    x_coord, y_coord = np.meshgrid(
+        np.arange(a.shape[1]), np.arange(a.shape[0]))
+
+    return np.sqrt(
+        (y_coord - center_point[0])**2 + (x_coord - center_point[1])**2)
+
+
+def per_frame_ms(func: Callable, frames: int) -> float:
+    """
+    Calls a function repeatedly and measures its mean wall clock time.
+
+    Parameters:
+    - func: Function without parameters to measure
+    - frames: Number of calls
+
+    Returns:
+    - ms: Mean time per call in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(frames):
+        func()
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def benchmark_frame_latency(shape: tuple = (2160, 3840, 3),
+                            frames: int = 20) -> pd.DataFrame:
+    """
+    Compares the per-frame latency of fading same-sized frames at 4K
+    resolution with the original implementation, with the cached mask, and
+    with the cached mask in place.
+
+    Parameters:
+    - shape: Shape of the frames
+    - frames: Number of frames to fade with each implementation
+
+    Returns:
+    - result_df: DataFrame with the mean latency of each implementation
+    """
+    frame = np.random.RandomState(0).random_sample(shape).astype(np.float32)
+    out = np.empty_like(frame)
+
+    expected = radial_fade_uncached(frame)
+    cached_radial_mask.cache_clear()
+
+    start = time.perf_counter()
+    result = radial_fade(frame)
+    first_frame_ms = (time.perf_counter() - start) * 1000
+
+    rows = []
+    for method, fade in (
+            ("uncached", lambda: radial_fade_uncached(frame)),
+            ("cached", lambda: radial_fade(frame)),
+            ("cached_out", lambda: radial_fade(frame, out=out))):
+        rows.append({"method": method, "ms_per_frame":
+                     per_frame_ms(fade, frames)})
+
+    result_df = pd.DataFrame(rows)
+    result_df["speedup"] = result_df["ms_per_frame"].iloc[0] / \
+        result_df["ms_per_frame"]
+
+    print(f"First cached frame, including the mask: {first_frame_ms:.1f} ms, "
+          f"max difference to the original: "
+          f"{np.abs(result - expected).max():.2e}")
+
+    return result_df
+
+
+def traced(func: Callable, *args, **kwargs) -> Tuple[float, float]:
+    """
+    Runs a function once and measures its wall clock time and the peak memory
+    allocated during the call.
+
+    Parameters:
+    - func: Function to measure
+    - args, kwargs: Arguments passed on to func
+
+    Returns:
+    - seconds: Wall clock time of the call in seconds
+    - peak_mb: Peak memory allocated during the call in MiB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak_bytes / 2**20
+
+
+def benchmark_tiled(sizes: tuple = (2048, 4096, 8192, 16384),
+                    in_memory_max_size: int = 4096,
+                    band_pixels: int = 2**20) -> pd.DataFrame:
+    """
+    Compares fading square uint8 RGB images stored in .npy files in memory
+    with the original implementation against radial_fade_file, which
+    processes memory-mapped files in bands of rows.
+
+    Parameters:
+    - sizes: Widths and heights of the images
+    - in_memory_max_size: Largest size to fade in memory
+    - band_pixels: Number of pixels per band for radial_fade_file
+
+    Returns:
+    - result_df: DataFrame with the time and peak memory of both approaches
+        per image size
+    """
+    rows = []
+
+    with tempfile.TemporaryDirectory() as image_dir:
+        in_path = os.path.join(image_dir, "image.npy")
+        out_path = os.path.join(image_dir, "faded.npy")
+
+        for size in sizes:
+            image = np.lib.format.open_memmap(
+                in_path, mode="w+", dtype=np.uint8, shape=(size, size, 3))
+            for row in range(size):
+                image[row] = row % 256
+            image.flush()
+            del image
+
+            def in_memory():
+                faded = radial_fade_uncached(np.load(in_path))
+                np.save(out_path, faded.astype(np.float32))
+
+            methods = [("tiled", lambda: radial_fade_file(
+                in_path, out_path, band_pixels=band_pixels))]
+            if size <= in_memory_max_size:
+                methods.insert(0, ("in_memory", in_memory))
+
+            for method, fade in methods:
+                seconds, peak_mb = traced(fade)
+                rows.append({
+                    "size": f"{size}x{size}",
+                    "image_mb": size * size * 3 / 2**20,
+                    "method": method,
+                    "seconds": seconds,
+                    "peak_mb": peak_mb
+                })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_stack(shape: tuple = (32, 1080, 1920, 3),
+                    thread_counts: tuple = (1, 2, 4, 8, 16),
+                    repeats: int = 3) -> pd.DataFrame:
+    """
+    Measures the throughput of radial_fade_stack on a stack of frames with
+    different numbers of threads, for uint8 frames with the fixed point path
+    and for float32 frames. As the baseline, the uint8 frames are also faded
+    one at a time with the original implementation, which converts them to
+    float64.
+
+    Parameters:
+    - shape: Shape of the stack, (N, H, W, C)
+    - thread_counts: Numbers of threads to measure
+    - repeats: Number of times to fade the stack per setup
+
+    Returns:
+    - result_df: DataFrame with the frames per second of each setup
+    """
+    rng = np.random.RandomState(0)
+    frames_uint8 = rng.randint(0, 256, size=shape, dtype=np.uint8)
+    frames_float32 = frames_uint8 / np.float32(255)
+    out_uint8 = np.empty_like(frames_uint8)
+    out_float32 = np.empty_like(frames_float32)
+
+    expected = np.stack([radial_fade_uncached(frame)
+                         for frame in frames_uint8[:2]])
+
+    def uncached():
+        for frame in frames_uint8:
+            radial_fade_uncached(frame)
+
+    rows = [{"dtype": "uint8", "method": "uncached per frame", "threads": 1,
+             "frames_per_s": shape[0] / per_frame_ms(uncached, 1) * 1000,
+             "max_diff": 0.0}]
+
+    for frames, out in ((frames_uint8, out_uint8),
+                        (frames_float32, out_float32)):
+        scale = 1 if frames.dtype == np.uint8 else 255
+        for threads in thread_counts:
+            ms = per_frame_ms(
+                lambda: radial_fade_stack(frames, out, n_threads=threads),
+                repeats)
+            rows.append({
+                "dtype": frames.dtype.name,
+                "method": "radial_fade_stack",
+                "threads": threads,
+                "frames_per_s": shape[0] / ms * 1000,
+                "max_diff": np.abs(out[:2] * scale - expected).max()
+            })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_profiles(shape: tuple = (2160, 3840),
+                       repeats: int = 10) -> pd.DataFrame:
+    """
+    Measures the cost of generating falloff masks of each profile at 4K
+    resolution, with a cold distance field cache and with the field already
+    cached, against radial_mask.
+
+    Parameters:
+    - shape: Height and width of the masks
+    - repeats: Number of masks to generate per profile with a warm cache
+
+    Returns:
+    - result_df: DataFrame with the time per mask of each profile
+    """
+    def cold(**kwargs):
+        squared_distance_field.cache_clear()
+        falloff_mask(shape, **kwargs)
+
+    profiles = (
+        ("linear", {"profile": "linear"}),
+        ("gamma", {"profile": "gamma", "gamma": 2.2}),
+        ("gaussian", {"profile": "gaussian", "sigma": 0.4}),
+        ("elliptical gaussian", {"profile": "gaussian", "sigma": 0.4,
+                                 "elliptical": True}),
+        ("custom smoothstep", {"profile": lambda field: 1 - field *
+                               (3 - 2 * np.sqrt(field))}),
+    )
+
+    baseline = np.broadcast_to(0, shape)
+    rows = [{"profile": "radial_mask", "cold_ms": per_frame_ms(
+        lambda: radial_mask(baseline), 1), "warm_ms": np.nan}]
+
+    for name, kwargs in profiles:
+        cold_ms = per_frame_ms(lambda: cold(**kwargs), 1)
+        warm_ms = per_frame_ms(lambda: falloff_mask(shape, **kwargs),
+                               repeats)
+        rows.append({"profile": name, "cold_ms": cold_ms, "warm_ms": warm_ms})
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_distance(
+        shapes: tuple = ((1080, 1920), (2160, 3840), (4320, 7680))) \
+        -> pd.DataFrame:
+    """
+    Compares the time and peak memory of radial_distance against the
+    original meshgrid implementation.
+
+    Parameters:
+    - shapes: Heights and widths of the arrays
+
+    Returns:
+    - result_df: DataFrame with the time, peak memory and largest relative
+        difference to the original of each implementation per shape
+    """
+    rows = []
+    for shape in shapes:
+        a = np.broadcast_to(0, shape)
+        expected = radial_distance_meshgrid(a)
+
+        for method, distance in (
+                ("meshgrid", lambda: radial_distance_meshgrid(a)),
+                ("separable float32", lambda: radial_distance(a)),
+                ("separable float64",
+                 lambda: radial_distance(a, dtype=np.float64)),
+                ("separable squared",
+                 lambda: radial_distance(a, squared=True))):
+            seconds, peak_mb = traced(distance)
+            result = distance()
+            if method == "separable squared":
+                result = np.sqrt(result)
+            rel_diff = np.abs(result - expected).max() / expected.max()
+
+            rows.append({
+                "shape": f"{shape[0]}x{shape[1]}",
+                "method": method,
+                "ms": seconds * 1000,
+                "peak_mb": peak_mb,
+                "max_rel_diff": rel_diff
+            })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    """
+    Main function, runs the benchmarks and prints the results.
+    """
+    print(benchmark_frame_latency())
+    print(benchmark_tiled())
+    print(benchmark_stack())
+    print(benchmark_profiles())
+    print(benchmark_distance())
+
+
+if __name__ == "__main__":
+    main()
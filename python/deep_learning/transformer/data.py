@@ -58,6 +58,7 @@ class TranslationDataset(Dataset):
     pairs_file = 'eng-fra_pairs_train.pkl'
     train_pairs_file = 'eng-fra_pairs_test.pkl'
     test_pairs_file = 'eng-fra_pairs.pkl'
+    encoded_suffix = '_encoded.pt'  # Pre-encoded pairs, saved next to the pickles
 
     def __init__(self, root, train=None):
         self.root = root
@@ -67,11 +68,70 @@ class TranslationDataset(Dataset):
         self.input_lang = pickle.load(open(os.path.join(folder, self.source_lang_file), "rb"))
         self.output_lang = pickle.load(open(os.path.join(folder, self.target_lang_file), "rb"))
         if train is None:
-            self.pairs = pickle.load(open(os.path.join(folder, self.pairs_file), "rb"))
+            pairs_path = os.path.join(folder, self.pairs_file)
         elif train:
-            self.pairs = pickle.load(open(os.path.join(folder, self.train_pairs_file), "rb"))
+            pairs_path = os.path.join(folder, self.train_pairs_file)
         else:
-            self.pairs = pickle.load(open(os.path.join(folder, self.test_pairs_file), "rb"))
+            pairs_path = os.path.join(folder, self.test_pairs_file)
+        self.pairs = pickle.load(open(pairs_path, "rb"))
+
+        self._load_encoded(pairs_path)
+
+    def _encode_pairs(self):
+        """Encodes all pairs into flat token buffers with EOS tokens and offsets."""
+        encoded = {}
+        for side, lang in ((0, self.input_lang), (1, self.output_lang)):
+            tokens = []
+            offsets = [0]
+            for pair in self.pairs:
+                tokens.extend(indexesFromSentence(lang, pair[side]))
+                tokens.append(EOS_token)
+                offsets.append(len(tokens))
+            encoded[side] = (torch.tensor(tokens, dtype=torch.long),
+                             torch.tensor(offsets, dtype=torch.long))
+        return encoded
+
+    def _load_encoded(self, pairs_path):
+        """Loads the encoded pairs saved next to the pairs pickle, encoding and
+        saving them first if they are missing or older than the pickle or the
+        language pickles the token ids come from."""
+        encoded_path = os.path.splitext(pairs_path)[0] + self.encoded_suffix
+        source_paths = [pairs_path,
+                        os.path.join(self._folder, self.source_lang_file),
+                        os.path.join(self._folder, self.target_lang_file)]
+        source_stamp = [[stat.st_size, stat.st_mtime_ns]
+                        for stat in map(os.stat, source_paths)]
+
+        data = None
+        if os.path.isfile(encoded_path):
+            data = torch.load(encoded_path)
+            if data.get('source') != source_stamp:
+                data = None
+
+        if data is None:
+            encoded = self._encode_pairs()
+            data = {
+                'source': source_stamp,
+                'input_tokens': encoded[0][0], 'input_offsets': encoded[0][1],
+                'output_tokens': encoded[1][0], 'output_offsets': encoded[1][1],
+            }
+            # A temporary file per process, so that processes building the
+            # dataset at the same time do not write to the same file. Saving
+            # is only an optimization, so e.g. a read-only dataset folder just
+            # goes without it.
+            tmp_path = '%s.%d.tmp' % (encoded_path, os.getpid())
+            try:
+                torch.save(data, tmp_path)
+                os.replace(tmp_path, encoded_path)
+            except (OSError, RuntimeError):  # torch.save raises RuntimeError
+                if os.path.isfile(tmp_path):
+                    os.remove(tmp_path)
+
+        self.input_tokens = data['input_tokens']
+        self.output_tokens = data['output_tokens']
+        # Offsets as lists, since indexing a list is faster than a tensor
+        self.input_offsets = data['input_offsets'].tolist()
+        self.output_offsets = data['output_offsets'].tolist()
 
     def _preprocess(self, lang1='eng', lang2='fra'):
         reverse = True
@@ -107,9 +167,13 @@ class TranslationDataset(Dataset):
         return len(self.pairs)
 
     def __getitem__(self, idx):
-        pair = self.pairs[idx]
-        input_seq = tensorFromSentence(self.input_lang, pair[0])
-        output_seq = tensorFromSentence(self.output_lang, pair[1])
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('TranslationDataset index out of range')
+        # Views into the token buffers, so they must not be modified in place
+        input_seq = self.input_tokens[self.input_offsets[idx]:self.input_offsets[idx + 1]]
+        output_seq = self.output_tokens[self.output_offsets[idx]:self.output_offsets[idx + 1]]
         return (input_seq, output_seq)
 
     def _check_integrity(self):
@@ -52,15 +52,51 @@ Possible improvements:
 - Enable giving the target measuring station as command line argument
 """
 
+import json
+import os
+from typing import Iterable, Iterator, List
+
+import numpy as np
 import pandas as pd
 from sklearn.linear_model import LinearRegression
 
+from frame_cache import FrameCache
+
+
+CYCLING_PATH = "src/Helsingin_pyorailijamaarat.csv"
+WEATHER_PATH = "src/kumpula-weather-2017.csv"
+
+# Cache for the cleaned source data, see frame_cache.py
+FRAME_CACHE = FrameCache()
+
+# Month numbers of the Finnish month names in the Päivämäärä column
+MONTH_MAP = {
+    "tammi": 1,
+    "helmi": 2,
+    "maalis": 3,
+    "huhti": 4,
+    "touko": 5,
+    "kesä": 6,
+    "heinä": 7,
+    "elo": 8,
+    "syys": 9,
+    "loka": 10,
+    "marras": 11,
+    "joulu": 12
+}
+
 
 def create_date_column(paivamaara_series: pd.Series):
     """
     Creates a Pandas datetime column from the original cycling data's
     Päivämäärä column.
 
+    The values are of the form "ke 1 tammi 2014 00:00". Each day string occurs
+    once per hour, so the column has far fewer unique days than rows. The
+    column is factorized and each unique value is parsed only once, after
+    which the results are broadcast back to the rows with the factorization
+    codes.
+
     Parameters:
     - paivamaara_series: Pandas Series with the Päivämäärä column from the
         original data
@@ -70,73 +106,53 @@ def create_date_column(paivamaara_series: pd.Series):
         as Pandas datetime
     """
 
-    # Split Päivämäärä column
-    date_df = paivamaara_series.str.split(expand=True)
-    date_df.columns = ['Weekday', 'Day', 'Month', 'Year', 'Hour']
-
-    # Map weekday and month from Finnish text
-    weekday_map = {
-        "ma": "Mon",
-        "ti": "Tue",
-        "ke": "Wed",
-        "to": "Thu",
-        "pe": "Fri",
-        "la": "Sat",
-        "su": "Sun"
-    }
-
-    month_map = {
-        "tammi": 1,
-        "helmi": 2,
-        "maalis": 3,
-        "huhti": 4,
-        "touko": 5,
-        "kesä": 6,
-        "heinä": 7,
-        "elo": 8,
-        "syys": 9,
-        "loka": 10,
-        "marras": 11,
-        "joulu": 12
-    }
-
-    date_df.iloc[:, 0] = date_df.iloc[:, 0].map(arg=weekday_map)
-    date_df.iloc[:, 2] = date_df.iloc[:, 2].map(arg=month_map)
-
-    # Drop minute information from timestamp
-    date_df.iloc[:, 4] = date_df.iloc[:, 4] \
-        .str.split(":") \
-        .apply(lambda x: x[0]) \
-        .astype(int)
-
-    # Convert remaining number strings to int
-    date_df = date_df.astype({"Day": int, "Year": int})
-
-    date_series = pd.to_datetime(date_df[["Year", "Month", "Day", "Hour"]])
+    # Unique timestamps, e.g. repeated exports of the same data
+    codes, timestamps = pd.factorize(paivamaara_series)
+    timestamps = pd.Series(timestamps)
+
+    # Split timestamps to day and hour, dropping minute information
+    day_codes, days = pd.factorize(timestamps.str[:-6])
+    hours = timestamps.str[-5:-3].astype(int)
+
+    # Parse unique days. Weekday is redundant with the date.
+    day_df = pd.Series(days).str.split(expand=True)
+    day_df.columns = ['Weekday', 'Day', 'Month', 'Year']
+
+    day_df = pd.DataFrame({
+        "Year": day_df["Year"].astype(int),
+        "Month": day_df["Month"].map(MONTH_MAP),
+        "Day": day_df["Day"].astype(int)
+    })
+    day_dates = pd.to_datetime(day_df).to_numpy()
+
+    # Broadcast days to unique timestamps and those to rows
+    timestamp_dates = day_dates[day_codes] + \
+        pd.to_timedelta(hours, unit="h").to_numpy()
+    dates = timestamp_dates[codes]
+    dates[codes == -1] = np.datetime64("NaT")
+
+    date_series = pd.Series(dates, index=paivamaara_series.index)
 
     return date_series
 
 
-def get_cycling_timeseries_2017(station: str):
+def read_cycling_data() -> pd.DataFrame:
     """
-    Calculates count of daily cyclists for the station given as parameter in
-    2017.
+    Reads and cleans the hourly cycling data of all measuring stations.
 
-    Assumes data is available in same folder as this script. Reads data,
-    reindexes using a Pandas datetime column and calculates daily counts of
-    cyclists.
+    Assumes data is available in same folder as this script. Reads data and
+    reindexes using a Pandas datetime column.
 
     Parameters:
-    - station: Name of measuring station to evaluate. Needs to be one of the
-        columns in the source data (e.g. "Baana" or "Merikannontie")
+    None
 
     Returns:
-    - cycling_df: DataFrame with daily counts of cyclists at the measuring
-        station
+    - cycling_df: DataFrame with hourly counts of cyclists at each measuring
+        station, indexed by datetime
     """
 
     # Load data
-    cycling_df = pd.read_csv("src/Helsingin_pyorailijamaarat.csv", sep=";")
+    cycling_df = pd.read_csv(CYCLING_PATH, sep=";")
 
     # Drop rows and columns with only null values
     cycling_df = cycling_df \
@@ -150,16 +166,313 @@ def get_cycling_timeseries_2017(station: str):
     # Drop redundan
     cycling_df.drop(["Päivämäärä"], axis="columns", inplace=True)
 
-    cycling_df = cycling_df.loc['2017', station]
+    return cycling_df
 
-    cycling_df = cycling_df \
-        .groupby(cycling_df.index.date) \
-        .sum()
 
-    return cycling_df
+def get_cycling_data(cache: FrameCache = FRAME_CACHE) -> pd.DataFrame:
+    """
+    Returns the cleaned hourly cycling data of all measuring stations, see
+    read_cycling_data.
+
+    Parameters:
+    - cache: Cache for the cleaned data, None to always read the source file
+
+    Returns:
+    - cycling_df: DataFrame with hourly counts of cyclists at each measuring
+        station, indexed by datetime
+    """
+    if cache is None:
+        return read_cycling_data()
+
+    return cache.cached("cycling_hourly", [CYCLING_PATH], read_cycling_data)
+
+
+def get_month_index(path: str = CYCLING_PATH) -> dict:
+    """
+    Returns an index of where each month starts in the cycling data file.
+
+    Building the index requires one pass over the lines of the file, but the
+    timestamps are not parsed beyond the month and year. The index is stored
+    in a small sidecar file next to the data file (path + ".months.json") and
+    reused for as long as the size and modification time of the data file
+    stay the same. Assumes the rows are in chronological order.
+
+    Parameters:
+    - path: Path to the cycling data file
+
+    Returns:
+    - month_index: Dictionary mapping "YYYY-MM" to a pair of the byte offset
+        of the first row of the month and the number of rows in the month
+    """
+    index_path = path + ".months.json"
+    stat = os.stat(path)
+
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["size"] == stat.st_size and \
+                index["mtime_ns"] == stat.st_mtime_ns:
+            return index["months"]
+
+    month_index = {}
+    month = None
+
+    with open(path, "rb") as f:
+        offset = len(f.readline())
+
+        for line in f:
+            # E.g. "ke 1 tammi 2014 00:00;..."; rows with only separators
+            # are counted to the current month
+            parts = line.split(b";", 1)[0].split()
+            if len(parts) >= 4:
+                month = f"{int(parts[3])}-" \
+                        f"{MONTH_MAP[parts[2].decode('utf-8')]:02d}"
+                if month not in month_index:
+                    month_index[month] = [offset, 0]
+
+            if month is not None:
+                month_index[month][1] += 1
+            offset += len(line)
+
+    # The index is only an optimization, so e.g. a read-only checkout just
+    # goes without it
+    try:
+        with open(index_path, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                       "months": month_index}, f)
+    except OSError:
+        pass
+
+    return month_index
+
+
+def date_range_mask(index: pd.DatetimeIndex, start: str = None,
+                    end: str = None) -> np.array:
+    """
+    Returns a boolean mask of the timestamps that fall on the days from start
+    to end, both inclusive. A missing start or end leaves the range open.
+    """
+    mask = np.ones(index.shape[0], dtype=bool)
+
+    if start is not None:
+        mask &= index >= pd.Timestamp(start).normalize()
+    if end is not None:
+        mask &= index < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+
+    return mask
+
+
+def iter_cycling_chunks(start: str = None, end: str = None,
+                        stations: List[str] = None, chunksize: int = 100_000,
+                        path: str = CYCLING_PATH) -> Iterator[pd.DataFrame]:
+    """
+    Reads and cleans the hourly cycling data of a date range in chunks.
+
+    Only the months overlapping the range are read: with the month index, the
+    file is read starting from the first row of the first month and only for
+    as many rows as those months have. Rows outside the range in the first
+    and last month are filtered out of each chunk.
+
+    Parameters:
+    - start: First day of the range, anything pd.Timestamp accepts. By
+        default from the start of the file.
+    - end: Last day of the range, inclusive. By default to the end of the
+        file.
+    - stations: Measuring stations to parse, by default all of them
+    - chunksize: Maximum number of rows to parse at a time
+    - path: Path to the cycling data file
+
+    Returns:
+    - Iterator over DataFrames with hourly counts of cyclists at each
+        measuring station, indexed by datetime, as in read_cycling_data
+    """
+    month_index = get_month_index(path)
+    if not month_index:
+        return
+
+    first_month = start if start is not None else next(iter(month_index))
+    last_month = end if end is not None else list(month_index)[-1]
+    months = [str(month) for month in
+              pd.period_range(first_month, last_month, freq="M")
+              if str(month) in month_index]
+    if not months:
+        return
+
+    first_offset = month_index[months[0]][0]
+    row_count = sum(month_index[month][1] for month in months)
+
+    # Column names from the header. The header ends with a separator, which
+    # gives an unnamed column without data.
+    columns = pd.read_csv(path, sep=";", nrows=0).columns
+    used_columns = [column for column in columns
+                    if not column.startswith("Unnamed")
+                    and (stations is None or column == "Päivämäärä"
+                         or column in stations)]
+
+    # Counts as float, like when parsing the whole file, where each station
+    # has missing values
+    dtypes = {column: np.float64 for column in used_columns
+              if column != "Päivämäärä"}
+
+    with open(path, "rb") as f:
+        f.seek(first_offset)
+        reader = pd.read_csv(f, sep=";", header=None, names=columns,
+                             usecols=used_columns, dtype=dtypes,
+                             nrows=row_count, chunksize=chunksize,
+                             encoding="utf-8")
+
+        for cycling_df in reader:
+            cycling_df = cycling_df.dropna(axis=0, how="all")
+
+            cycling_df["Date"] = create_date_column(cycling_df["Päivämäärä"])
+            cycling_df = cycling_df \
+                .set_index("Date") \
+                .drop(["Päivämäärä"], axis="columns")
+
+            yield cycling_df[date_range_mask(cycling_df.index, start, end)]
+
+
+def iter_cycling_range(start: str, end: str, stations: List[str] = None,
+                       cache: FrameCache = FRAME_CACHE) \
+        -> Iterator[pd.DataFrame]:
+    """
+    Yields the cleaned hourly cycling data on the days from start to end.
+
+    If the cache holds the cleaned data of the whole file, the range is taken
+    from it as a single frame. Otherwise only the months of the range are
+    read from the source file in chunks, see iter_cycling_chunks.
+
+    Parameters:
+    - start: First day of the range, anything pd.Timestamp accepts
+    - end: Last day of the range, inclusive
+    - stations: Measuring stations to include, by default all of them
+    - cache: Cache for the cleaned data, None to always read the source file
+
+    Returns:
+    - Iterator over DataFrames with hourly counts of cyclists at each
+        measuring station, indexed by datetime
+    """
+    cycling_df = cache.get("cycling_hourly", [CYCLING_PATH]) \
+        if cache is not None else None
+
+    if cycling_df is None:
+        yield from iter_cycling_chunks(start, end, stations)
+        return
+
+    if stations is not None:
+        cycling_df = cycling_df[stations]
+
+    yield cycling_df[date_range_mask(cycling_df.index, start, end)]
+
+
+def read_cycling_range(start: str, end: str,
+                       cache: FrameCache = FRAME_CACHE) -> pd.DataFrame:
+    """
+    Returns the cleaned hourly cycling data of all measuring stations on the
+    days from start to end, see iter_cycling_range.
+
+    Parameters:
+    - start: First day of the range, anything pd.Timestamp accepts
+    - end: Last day of the range, inclusive
+    - cache: Cache for the cleaned data, None to always read the source file
+
+    Returns:
+    - cycling_df: DataFrame with hourly counts of cyclists at each measuring
+        station, indexed by datetime
+    """
+    chunks = list(iter_cycling_range(start, end, cache=cache))
+    if not chunks:
+        columns = [column for column in
+                   pd.read_csv(CYCLING_PATH, sep=";", nrows=0).columns
+                   if column != "Päivämäärä"
+                   and not column.startswith("Unnamed")]
+        return pd.DataFrame(columns=columns, dtype=np.float64,
+                            index=pd.DatetimeIndex([], name="Date"))
+
+    return pd.concat(chunks)
+
+
+def aggregate_daily(chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Sums hourly counts into daily counts, one chunk at a time.
 
+    The timestamps of each chunk are converted to integer day ordinals (days
+    since 1970-01-01), which are much faster to group by than Python date
+    objects, and each chunk's daily sums are added to the running totals.
+    Only one chunk of hourly rows is held in memory at a time.
 
-def get_weather_timeseries_2017():
+    Parameters:
+    - chunks: DataFrames of hourly counts indexed by datetime, e.g. from
+        iter_cycling_chunks
+
+    Returns:
+    - daily_df: DataFrame of daily counts indexed by date (as datetime at
+        midnight). Missing hourly values count as zero.
+    """
+    daily_df = None
+
+    for chunk in chunks:
+        days = chunk.index.to_numpy().astype("datetime64[D]").astype(np.int64)
+        chunk_daily = chunk.groupby(days).sum()
+
+        # Consecutive chunks share at most the day at the chunk boundary
+        daily_df = chunk_daily if daily_df is None \
+            else daily_df.add(chunk_daily, fill_value=0)
+
+    if daily_df is None:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="Date"))
+
+    daily_df.index = pd.DatetimeIndex(
+        pd.to_datetime(daily_df.index, unit="D"), name="Date")
+
+    return daily_df
+
+
+def get_cycling_timeseries(station: str, start: str, end: str,
+                           cache: FrameCache = FRAME_CACHE):
+    """
+    Calculates count of daily cyclists for the station given as parameter on
+    the days from start to end.
+
+    The hourly data is read and summed to days chunk by chunk, see
+    iter_cycling_range and aggregate_daily.
+
+    Parameters:
+    - station: Name of measuring station to evaluate. Needs to be one of the
+        columns in the source data (e.g. "Baana" or "Merikannontie")
+    - start: First day of the range, anything pd.Timestamp accepts
+    - end: Last day of the range, inclusive
+    - cache: Cache for the cleaned data, None to always read the source file
+
+    Returns:
+    - cycling_df: DataFrame with daily counts of cyclists at the measuring
+        station
+    """
+    daily_df = aggregate_daily(
+        iter_cycling_range(start, end, stations=[station], cache=cache))
+
+    return daily_df[station]
+
+
+def get_cycling_timeseries_2017(station: str,
+                                cache: FrameCache = FRAME_CACHE):
+    """
+    Calculates count of daily cyclists for the station given as parameter in
+    2017, see get_cycling_timeseries.
+
+    Parameters:
+    - station: Name of measuring station to evaluate. Needs to be one of the
+        columns in the source data (e.g. "Baana" or "Merikannontie")
+    - cache: Cache for the cleaned data, None to always read the source file
+
+    Returns:
+    - cycling_df: DataFrame with daily counts of cyclists at the measuring
+        station
+    """
+    return get_cycling_timeseries(station, "2017-01-01", "2017-12-31", cache)
+
+
+def read_weather_data() -> pd.DataFrame:
     """
     Creates a datetime-indexed DataFrame of weather data per day in 2017.
 
@@ -172,7 +485,7 @@ def get_weather_timeseries_2017():
     Returns:
     - weather_df: Pandas DataFrame with a datetime index for daily weather data
     """
-    weather_df = pd.read_csv("src/kumpula-weather-2017.csv")
+    weather_df = pd.read_csv(WEATHER_PATH)
 
     # -1 value in columns "Precipitation amount (mm)" and "Snow depth (cm)" mean
     # that there was no absolutely no rain or snow that day, whereas 0 can mean
@@ -197,7 +510,24 @@ def get_weather_timeseries_2017():
     return weather_df
 
 
-def cycling_weather_linregr(station: str):
+def get_weather_timeseries_2017(cache: FrameCache = FRAME_CACHE):
+    """
+    Creates a datetime-indexed DataFrame of weather data per day in 2017, see
+    read_weather_data.
+
+    Parameters:
+    - cache: Cache for the cleaned data, None to always read the source file
+
+    Returns:
+    - weather_df: Pandas DataFrame with a datetime index for daily weather data
+    """
+    if cache is None:
+        return read_weather_data()
+
+    return cache.cached("weather_daily", [WEATHER_PATH], read_weather_data)
+
+
+def cycling_weather_linregr(station: str, cache: FrameCache = FRAME_CACHE):
     """
     Runs linear regression comparing daily weather data against cyclist counts
     at a specific measuring station in Helsinki.
@@ -205,6 +535,7 @@ def cycling_weather_linregr(station: str):
     Parameters:
     - station: Name of measuring station to evaluate. Needs to be one of the
         columns in the source data (e.g. "Baana" or "Merikannontie")
+    - cache: Cache for the cleaned data, None to always read the source files
 
     Returns:
     - tuple(model.coef_): Tuple of coefficients for each of the predicting
@@ -216,8 +547,8 @@ def cycling_weather_linregr(station: str):
     # daily cyclists at the measuring station given as
     # parameter
 
-    cycling_data = get_cycling_timeseries_2017(station)
-    weather_data = get_weather_timeseries_2017()
+    cycling_data = get_cycling_timeseries_2017(station, cache)
+    weather_data = get_weather_timeseries_2017(cache)
 
     merged_df = pd.merge(
         left=weather_data,
@@ -237,6 +568,83 @@ def cycling_weather_linregr(station: str):
     return (tuple(model.coef_), r2)
 
 
+def get_daily_dataset_2017(cache: FrameCache = FRAME_CACHE) -> pd.DataFrame:
+    """
+    Creates a merged dataset of daily weather data and daily cyclists at every
+    measuring station in 2017.
+
+    Parameters:
+    - cache: Cache for the cleaned data, None to always read the source files
+
+    Returns:
+    - merged_df: DataFrame indexed by date, with the weather columns first,
+        followed by one column of daily cyclists per measuring station
+    """
+    cycling_df = get_cycling_data(cache)
+    cycling_data = aggregate_daily(
+        [cycling_df[date_range_mask(cycling_df.index, "2017-01-01",
+                                    "2017-12-31")]])
+    weather_data = get_weather_timeseries_2017(cache)
+
+    merged_df = pd.merge(
+        left=weather_data,
+        left_index=True,
+        right=cycling_data,
+        right_index=True,
+        how="left"
+    ).fillna(method='ffill')
+
+    return merged_df
+
+
+def cycling_weather_linregr_all_stations(cache: FrameCache = FRAME_CACHE) \
+        -> pd.DataFrame:
+    """
+    Runs the linear regression of cycling_weather_linregr for every measuring
+    station at once.
+
+    The data is loaded once and the daily counts of all stations are summed in
+    a single groupby. As the explanatory variables are the same for every
+    station, all regressions are solved with a single least squares solve with
+    one target column per station.
+
+    Parameters:
+    - cache: Cache for the cleaned data, None to always read the source files
+
+    Returns:
+    - result_df: DataFrame indexed by station with the intercept, the
+        coefficient of each explanatory variable and the R2 score
+    """
+    merged_df = get_daily_dataset_2017(cache)
+
+    explanatory_columns = merged_df.columns[:3]
+    station_columns = merged_df.columns[3:]
+    weather_explanatory = merged_df[explanatory_columns].to_numpy()
+    cyclists_dependent = merged_df[station_columns].to_numpy()
+
+    # Add a column of ones for the intercept
+    design = np.column_stack(
+        (np.ones(weather_explanatory.shape[0]), weather_explanatory))
+    coefs, *_ = np.linalg.lstsq(design, cyclists_dependent, rcond=None)
+
+    # R2 per station, with the same convention as LinearRegression.score for
+    # a constant target: 1.0 for a perfect fit, otherwise 0.0
+    residual_ss = ((cyclists_dependent - design @ coefs)**2).sum(axis=0)
+    total_ss = ((cyclists_dependent -
+                 cyclists_dependent.mean(axis=0))**2).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = np.where(total_ss > 0, 1 - residual_ss / total_ss,
+                      np.where(residual_ss > 0, 0.0, 1.0))
+
+    result_df = pd.DataFrame(
+        coefs.T,
+        index=pd.Index(station_columns, name="Station"),
+        columns=["Intercept"] + list(explanatory_columns))
+    result_df["Score"] = r2
+
+    return result_df
+
+
 def main():
     """
     Main function. Prints results from model training.
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the cycling weather linear regression exercise.
+
+Run from the cycling_weather_linregr folder like the exercise itself, so that
+the relative paths to the source data in src resolve:
+
+    python src/cycling_weather_linregr_benchmark.py
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import r2_score
+
+from cycling_weather_linregr import (MONTH_MAP, aggregate_daily,
+                                     create_date_column,
+                                     cycling_weather_linregr,
+                                     cycling_weather_linregr_all_stations,
+                                     get_cycling_data,
+                                     get_daily_dataset_2017,
+                                     get_weather_timeseries_2017,
+                                     iter_cycling_chunks)
+from frame_cache import FrameCache
+from incremental_regression import IncrementalLinearRegression
+
+
+def create_date_column_rowwise(paivamaara_series: pd.Series) -> pd.Series:
+    """
+    The original row by row implementation of create_date_column, kept as the
+    baseline for benchmarking.
+
+    Parameters:
+    - paivamaara_series: Pandas Series with the Päivämäärä column from the
+        original data
+
+    Returns:
+    - date_series: Pandas Series with the same information as Päivämäärä but
+        as Pandas datetime
+    """
+    date_df = paivamaara_series.str.split(expand=True)
+    date_df.columns = ['Weekday', 'Day', 'Month', 'Year', 'Hour']
+
+    month_map = {
+        "tammi": 1, "helmi": 2, "maalis": 3, "huhti": 4, "touko": 5,
+        "kesä": 6, "heinä": 7, "elo": 8, "syys": 9, "loka": 10,
+        "marras": 11, "joulu": 12
+    }
+
+    date_df["Month"] = date_df["Month"].map(arg=month_map)
+    date_df["Hour"] = date_df["Hour"] \
+        .str.split(":") \
+        .apply(lambda x: x[0]) \
+        .astype(int)
+    date_df = date_df.astype({"Day": int, "Year": int})
+
+    return pd.to_datetime(date_df[["Year", "Month", "Day", "Hour"]])
+
+
+def timed(func: Callable, *args, **kwargs) -> Tuple[object, float]:
+    """
+    Runs a function once and measures its wall clock time.
+
+    Parameters:
+    - func: Function to measure
+    - args, kwargs: Arguments passed on to func
+
+    Returns:
+    - result: Return value of func
+    - seconds: Wall clock time of the call in seconds
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_date_parsing(replications: tuple = (1, 10, 100)) \
+        -> pd.DataFrame:
+    """
+    Compares create_date_column against the original row by row parser on
+    the Päivämäärä column of the cycling data replicated a number of times.
+
+    Parameters:
+    - replications: How many times to replicate the column
+
+    Returns:
+    - result_df: DataFrame with the parsing time of both implementations per
+        replication
+    """
+    cycling_df = pd.read_csv("src/Helsingin_pyorailijamaarat.csv", sep=";") \
+        .dropna(axis=0, how="all")
+    paivamaara_series = cycling_df["Päivämäärä"]
+
+    rows = []
+    for replication in replications:
+        series = pd.concat([paivamaara_series] * replication,
+                           ignore_index=True)
+
+        expected, rowwise_seconds = timed(create_date_column_rowwise, series)
+        result, factorized_seconds = timed(create_date_column, series)
+
+        rows.append({
+            "replication": replication,
+            "rows": series.shape[0],
+            "rowwise_s": rowwise_seconds,
+            "factorized_s": factorized_seconds,
+            "speedup": rowwise_seconds / factorized_seconds,
+            "equal": result.equals(expected)
+        })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_frame_cache() -> pd.DataFrame:
+    """
+    Compares loading the cleaned cycling and weather data without the frame
+    cache, on a cold cache (read, clean and write the cache) and on a warm
+    cache (read the cached file).
+
+    Parameters:
+    None
+
+    Returns:
+    - result_df: DataFrame with the load times of each dataset
+    """
+    rows = []
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FrameCache(cache_dir)
+
+        for name, load in (("cycling", get_cycling_data),
+                           ("weather", get_weather_timeseries_2017)):
+            _, uncached_seconds = timed(load, cache=None)
+            _, cold_seconds = timed(load, cache=cache)
+            _, warm_seconds = timed(load, cache=cache)
+
+            rows.append({
+                "dataset": name,
+                "uncached_s": uncached_seconds,
+                "cold_s": cold_seconds,
+                "warm_s": warm_seconds,
+                "speedup": uncached_seconds / warm_seconds
+            })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_all_stations() -> pd.DataFrame:
+    """
+    Compares running cycling_weather_linregr separately for every station
+    against cycling_weather_linregr_all_stations, both without the frame
+    cache.
+
+    Parameters:
+    None
+
+    Returns:
+    - result_df: DataFrame with the time of both approaches
+    """
+    result_df, all_stations_seconds = timed(
+        cycling_weather_linregr_all_stations, cache=None)
+
+    start = time.perf_counter()
+    for station in result_df.index:
+        cycling_weather_linregr(station, cache=None)
+    per_station_seconds = time.perf_counter() - start
+
+    return pd.DataFrame([{
+        "stations": result_df.shape[0],
+        "per_station_s": per_station_seconds,
+        "all_stations_s": all_stations_seconds,
+        "speedup": per_station_seconds / all_stations_seconds
+    }])
+
+
+def benchmark_incremental_regression(window: int = 90) -> pd.DataFrame:
+    """
+    Feeds the 2017 daily data of all stations to IncrementalLinearRegression
+    one day at a time, and checks the coefficients and R2 scores against a
+    batch LinearRegression fit on the same days, which serves as the
+    correctness oracle. Also compares the time of one incremental update
+    against one batch refit.
+
+    Parameters:
+    - window: Size of the sliding window to check in addition to the full data
+
+    Returns:
+    - result_df: DataFrame with the largest deviation from the batch fit and
+        the time per day of both approaches, per window setting
+    """
+    merged_df = get_daily_dataset_2017()
+    weather = merged_df.iloc[:, :3].to_numpy()
+    counts = merged_df.iloc[:, 3:].to_numpy()
+
+    rows = []
+    for window_size in (None, window):
+        model = IncrementalLinearRegression(
+            weather.shape[1], counts.shape[1], window=window_size)
+
+        update_seconds = 0.0
+        refit_seconds = 0.0
+        max_coef_diff = 0.0
+        max_r2_diff = 0.0
+
+        for day in range(weather.shape[0]):
+            start = time.perf_counter()
+            model.update(weather[day], counts[day])
+            coefs, r2 = model.coef_, model.score()
+            update_seconds += time.perf_counter() - start
+
+            first = 0 if window_size is None else \
+                max(0, day + 1 - window_size)
+            if day + 1 - first <= weather.shape[1] + 1:
+                # Too few days for a unique solution
+                continue
+
+            start = time.perf_counter()
+            batch = LinearRegression().fit(
+                weather[first:day + 1], counts[first:day + 1])
+            batch_r2 = r2_score(
+                counts[first:day + 1], batch.predict(weather[first:day + 1]),
+                multioutput="raw_values")
+            refit_seconds += time.perf_counter() - start
+
+            max_coef_diff = max(max_coef_diff,
+                                np.abs(coefs - batch.coef_).max())
+            max_r2_diff = max(max_r2_diff, np.abs(r2 - batch_r2).max())
+
+        rows.append({
+            "window": window_size or "all",
+            "days": weather.shape[0],
+            "max_coef_diff": max_coef_diff,
+            "max_r2_diff": max_r2_diff,
+            "update_ms_per_day": update_seconds / weather.shape[0] * 1000,
+            "refit_ms_per_day": refit_seconds / weather.shape[0] * 1000
+        })
+
+    return pd.DataFrame(rows)
+
+
+def write_synthetic_counter_csv(path: str, rows: int, stations: int = 20,
+                                random_state: int = 0):
+    """
+    Writes a synthetic hourly counter export in the format of
+    Helsingin_pyorailijamaarat.csv, starting from 1.1.1990.
+
+    Parameters:
+    - path: Path of the CSV file to write
+    - rows: Number of hourly rows
+    - stations: Number of measuring station columns
+    - random_state: Seed for the random counts
+    """
+    weekdays = np.array(["ma", "ti", "ke", "to", "pe", "la", "su"])
+    months = np.array([""] + list(MONTH_MAP))
+    rng = np.random.RandomState(random_state)
+
+    with open(path, "w", encoding="utf-8") as f:
+        names = [f"Asema {i}" for i in range(stations)]
+        f.write(";".join(["Päivämäärä"] + names) + ";\n")
+
+        all_timestamps = pd.date_range("1990-01-01", freq="h", periods=rows)
+
+        for start in range(0, rows, 100_000):
+            timestamps = all_timestamps[start:start + 100_000]
+            paivamaara = pd.Series(weekdays[timestamps.weekday]) + " " + \
+                timestamps.day.astype(str) + " " + \
+                months[timestamps.month] + " " + \
+                timestamps.year.astype(str) + " " + \
+                timestamps.strftime("%H:00")
+
+            counts = pd.DataFrame(
+                rng.randint(0, 100, size=(len(timestamps), stations)))
+            counts.insert(0, "Päivämäärä", paivamaara.to_numpy())
+            counts[stations] = ""
+            counts.to_csv(f, sep=";", header=False, index=False)
+
+
+def read_daily_in_memory(path: str) -> pd.DataFrame:
+    """
+    Reads a counter export in full and sums it to days by Python date
+    objects, as get_cycling_timeseries_2017 did originally.
+    """
+    cycling_df = pd.read_csv(path, sep=";") \
+        .dropna(axis=0, how="all") \
+        .dropna(axis=1, how="all")
+    cycling_df["Date"] = create_date_column(cycling_df["Päivämäärä"])
+    cycling_df = cycling_df \
+        .set_index("Date") \
+        .drop(["Päivämäärä"], axis="columns")
+
+    return cycling_df.groupby(cycling_df.index.date).sum()
+
+
+def benchmark_daily_aggregation(row_counts: tuple = (1_000_000, 3_000_000),
+                                chunksize: int = 100_000) -> pd.DataFrame:
+    """
+    Compares reading a synthetic counter export in full and grouping by date
+    objects against the streaming aggregate_daily, in terms of time and peak
+    memory.
+
+    Parameters:
+    - row_counts: Numbers of hourly rows in the synthetic exports
+    - chunksize: Rows per chunk for the streaming aggregation
+
+    Returns:
+    - result_df: DataFrame with time and peak memory of both approaches
+    """
+    rows = []
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        for row_count in row_counts:
+            path = os.path.join(data_dir, f"counters_{row_count}.csv")
+            write_synthetic_counter_csv(path, row_count)
+
+            # Build the month index outside of the measurement
+            sum(1 for _ in iter_cycling_chunks("1990-01-01", "1990-01-01",
+                                               path=path))
+
+            for method, aggregate in (
+                    ("in_memory", lambda: read_daily_in_memory(path)),
+                    ("streaming", lambda: aggregate_daily(iter_cycling_chunks(
+                        chunksize=chunksize, path=path)))):
+                tracemalloc.start()
+                daily_df, seconds = timed(aggregate)
+                _, peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                rows.append({
+                    "rows": row_count,
+                    "method": method,
+                    "days": daily_df.shape[0],
+                    "seconds": seconds,
+                    "peak_mb": peak_bytes / 2**20,
+                    "rows_per_s": row_count / seconds
+                })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    """
+    Main function, runs the benchmarks and prints the results.
+    """
+    print(benchmark_date_parsing())
+    print(benchmark_frame_cache())
+    print("All measuring stations:")
+    print(cycling_weather_linregr_all_stations().round(2))
+    print(benchmark_all_stations())
+    print(benchmark_incremental_regression())
+    print(benchmark_daily_aggregation())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Columnar on-disk cache for cleaned DataFrames.
+
+Reading and cleaning the source CSV files takes far longer than reading the
+cleaned result back from an uncompressed Feather file. The file is memory
+mapped for reading, but converting it to a DataFrame still copies the columns
+into pandas memory, so loading from the cache is a fast read rather than a
+memory map of the frame. A cached frame is valid for as long as its source
+files are unchanged, which is checked from their size and modification time,
+and from their content hash if the modification time has changed.
+"""
+
+import hashlib
+import json
+import os
+from typing import Callable, List
+
+import pandas as pd
+import pyarrow.feather as feather
+
+
+def file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 hash of the contents of a file.
+
+    Parameters:
+    - path: Path to the file
+
+    Returns:
+    - digest: Hex digest of the file contents
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class FrameCache:
+    """
+    Stores DataFrames derived from source files as Feather files in a
+    directory.
+
+    Each entry consists of <name>.feather with the data and <name>.json with
+    the index name and the size, modification time and hash of each source
+    file.
+    """
+
+    def __init__(self, directory: str = "src/.frame_cache"):
+        self.directory = directory
+
+    def _paths(self, name: str) -> (str, str):
+        base = os.path.join(self.directory, name)
+        return base + ".feather", base + ".json"
+
+    @staticmethod
+    def _source_stats(sources: List[str]) -> List[dict]:
+        return [{"path": path,
+                 "size": os.stat(path).st_size,
+                 "mtime_ns": os.stat(path).st_mtime_ns}
+                for path in sources]
+
+    def _is_fresh(self, meta: dict, sources: List[str]) -> bool:
+        """
+        Checks whether the sources of a cache entry are unchanged. If only the
+        modification time of a source has changed but not its contents, the
+        metadata is updated and the entry stays valid.
+        """
+        stats = self._source_stats(sources)
+        if len(stats) != len(meta["sources"]):
+            return False
+
+        touched = False
+        for stat, cached in zip(stats, meta["sources"]):
+            if stat["path"] != cached["path"] or \
+                    stat["size"] != cached["size"]:
+                return False
+            if stat["mtime_ns"] != cached["mtime_ns"]:
+                if file_hash(stat["path"]) != cached["sha256"]:
+                    return False
+                cached["mtime_ns"] = stat["mtime_ns"]
+                touched = True
+
+        # Recording the new modification times only saves hashing the
+        # sources again, so the entry stays valid if it cannot be written
+        if touched:
+            try:
+                self._write_meta(meta["name"], meta)
+            except OSError:
+                pass
+
+        return True
+
+    def _write_meta(self, name: str, meta: dict):
+        meta_path = self._paths(name)[1]
+
+        # Write to a temporary file first, so that an interrupted write never
+        # leaves partial metadata behind
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def get(self, name: str, sources: List[str]) -> pd.DataFrame:
+        """
+        Loads a cached frame if its sources are unchanged.
+
+        Parameters:
+        - name: Name of the cache entry
+        - sources: Paths to the source files the frame is derived from
+
+        Returns:
+        - df: The cached DataFrame with its index restored, or None if there
+            is no valid entry
+        """
+        data_path, meta_path = self._paths(name)
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        if not os.path.isfile(data_path) or not self._is_fresh(meta, sources):
+            return None
+
+        # The memory map saves reading the file into a buffer first, but
+        # to_pandas copies the columns
+        table = feather.read_table(data_path, memory_map=True)
+
+        return table.to_pandas().set_index(meta["index"])
+
+    def put(self, name: str, sources: List[str], df: pd.DataFrame):
+        """
+        Stores a frame derived from source files.
+
+        Parameters:
+        - name: Name of the cache entry
+        - sources: Paths to the source files the frame is derived from
+        - df: DataFrame with a named index and string column names
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, meta_path = self._paths(name)
+
+        # Uncompressed, so that reading needs no decompression. The data is
+        # written to a temporary file first, and the old metadata is removed
+        # before the data is replaced, so that an interrupted put never leaves
+        # metadata next to data it does not describe.
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        feather.write_feather(df.reset_index(), tmp_path,
+                              compression="uncompressed")
+
+        try:
+            os.remove(meta_path)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, data_path)
+
+        sources_meta = self._source_stats(sources)
+        for source in sources_meta:
+            source["sha256"] = file_hash(source["path"])
+
+        self._write_meta(name, {"name": name, "index": df.index.name,
+                                "sources": sources_meta})
+
+    def cached(self, name: str, sources: List[str],
+               build: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Returns a cached frame, building and storing it first if needed.
+
+        Parameters:
+        - name: Name of the cache entry
+        - sources: Paths to the source files the frame is derived from
+        - build: Function without parameters that builds the frame from the
+            sources
+
+        Returns:
+        - df: The DataFrame
+        """
+        df = self.get(name, sources)
+
+        if df is None:
+            df = build()
+
+            # The cache is only an optimization, so e.g. a read-only checkout
+            # just goes without it
+            try:
+                self.put(name, sources, df)
+            except OSError:
+                pass
+
+        return df
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Incrementally updated linear regression.
+
+The ordinary least squares solution with intercept only depends on the
+sufficient statistics X^T X, X^T y, y^T y and the number of observations n,
+where X includes a column of ones. Each new observation adds its outer products
+to these in O(features^2) time, and removing an old observation subtracts them
+again (downdating). This makes it possible to keep a regression of daily
+cycling counts on weather up to date as new days arrive, optionally over a
+sliding window of the most recent days, without refitting on the full data.
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+class IncrementalLinearRegression:
+    """
+    Linear regression with intercept for one or more targets, updated one
+    observation at a time.
+
+    All targets share the explanatory variables, e.g. the daily weather, and
+    have one column each in the target matrix, e.g. the daily counts of each
+    measuring station.
+
+    Parameters:
+    - n_features: Number of explanatory variables
+    - n_targets: Number of target variables
+    - window: If given, only the window most recent observations are kept in
+        the model. Older observations are downdated as new ones arrive.
+    """
+
+    def __init__(self, n_features: int, n_targets: int = 1,
+                 window: int = None):
+        self.n_features = n_features
+        self.n_targets = n_targets
+        self.window = window
+
+        # Sufficient statistics, with the intercept as the first column of X
+        self._xtx = np.zeros((n_features + 1, n_features + 1))
+        self._xty = np.zeros((n_features + 1, n_targets))
+        self._yty = np.zeros(n_targets)
+        self.n_ = 0
+
+        # Observations in the window, needed for downdating
+        self._observations = deque()
+
+    def _add(self, x: np.array, y: np.array, sign: float):
+        z = np.concatenate(([1.0], x))
+        self._xtx += sign * np.outer(z, z)
+        self._xty += sign * np.outer(z, y)
+        self._yty += sign * y * y
+        self.n_ += int(sign)
+
+    def update(self, x: np.array, y: np.array):
+        """
+        Adds an observation to the model. If the model has a window and it is
+        full, the oldest observation is removed.
+
+        Parameters:
+        - x: Explanatory variables of the observation, shape (n_features,)
+        - y: Target variables of the observation, shape (n_targets,) or a
+            scalar for a single target
+        """
+        x = np.asarray(x, dtype=np.float64).reshape(self.n_features)
+        y = np.asarray(y, dtype=np.float64).reshape(self.n_targets)
+
+        self._add(x, y, 1.0)
+
+        if self.window is not None:
+            self._observations.append((x, y))
+            if len(self._observations) > self.window:
+                self.downdate(*self._observations.popleft())
+
+    def downdate(self, x: np.array, y: np.array):
+        """
+        Removes an observation that was previously added to the model.
+
+        Parameters:
+        - x: Explanatory variables of the observation, shape (n_features,)
+        - y: Target variables of the observation, shape (n_targets,) or a
+            scalar for a single target
+        """
+        x = np.asarray(x, dtype=np.float64).reshape(self.n_features)
+        y = np.asarray(y, dtype=np.float64).reshape(self.n_targets)
+
+        self._add(x, y, -1.0)
+
+    def partial_fit(self, X: np.array, Y: np.array):
+        """
+        Adds observations to the model one at a time, see update.
+
+        Parameters:
+        - X: Explanatory variables, shape (n_observations, n_features)
+        - Y: Target variables, shape (n_observations, n_targets) or
+            (n_observations,) for a single target
+        """
+        Y = np.asarray(Y).reshape(len(X), self.n_targets)
+        for x, y in zip(X, Y):
+            self.update(x, y)
+
+        return self
+
+    def _solve(self) -> np.array:
+        # lstsq instead of solve, so that a singular X^T X, e.g. with fewer
+        # observations than variables, gives the minimum norm solution
+        return np.linalg.lstsq(self._xtx, self._xty, rcond=None)[0]
+
+    @property
+    def coef_(self) -> np.array:
+        """
+        Regression coefficients, shape (n_targets, n_features).
+        """
+        return self._solve()[1:].T
+
+    @property
+    def intercept_(self) -> np.array:
+        """
+        Intercepts, shape (n_targets,).
+        """
+        return self._solve()[0]
+
+    def score(self) -> np.array:
+        """
+        Returns the R2 score of each target on the observations in the model.
+
+        As with LinearRegression.score, a target without variance gets a score
+        of 1.0 if it is fitted perfectly and 0.0 otherwise.
+
+        Returns:
+        - r2: Numpy array of R2 scores, shape (n_targets,)
+        """
+        beta = self._solve()
+
+        residual_ss = self._yty - 2 * (beta * self._xty).sum(axis=0) + \
+            (beta * (self._xtx @ beta)).sum(axis=0)
+        total_ss = self._yty - self._xty[0]**2 / max(self.n_, 1)
+
+        # Relative tolerance for the rounding errors of the sums of squares
+        tolerance = 1e-12 * np.maximum(self._yty, 1.0)
+        residual_ss = np.where(residual_ss > tolerance, residual_ss, 0.0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total_ss > tolerance, 1 - residual_ss / total_ss,
+                            np.where(residual_ss > 0, 0.0, 1.0))
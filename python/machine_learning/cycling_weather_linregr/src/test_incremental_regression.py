@@ -0,0 +1,100 @@
+"""
+Tests for IncrementalLinearRegression, with LinearRegression fitted on the
+same observations as the oracle. Run from the cycling_weather_linregr folder:
+
+    python -m pytest src
+"""
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from incremental_regression import IncrementalLinearRegression
+
+
+def make_days(n_days: int = 120, n_features: int = 3, n_targets: int = 4):
+    """
+    Returns weather-like explanatory variables and noisy linear targets.
+    """
+    rng = np.random.RandomState(0)
+    X = rng.normal([5.0, 2.0, 10.0], [8.0, 5.0, 3.0], (n_days, n_features))
+    coef = rng.uniform(-50, 50, (n_features, n_targets))
+    Y = 1000 + X @ coef + rng.normal(0, 20, (n_days, n_targets))
+
+    return X, Y
+
+
+def assert_matches_batch(model: IncrementalLinearRegression, X: np.array,
+                         Y: np.array):
+    """
+    Asserts that the model matches LinearRegression fitted on X and Y.
+    """
+    batch = LinearRegression().fit(X, Y)
+    Y_2d = Y.reshape(len(X), -1)
+
+    np.testing.assert_allclose(model.coef_,
+                               np.reshape(batch.coef_, model.coef_.shape),
+                               rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(model.intercept_,
+                               np.reshape(batch.intercept_, -1),
+                               rtol=1e-6, atol=1e-6)
+    # LinearRegression.score averages over the targets, so score each
+    # target separately
+    np.testing.assert_allclose(
+        model.score(),
+        [LinearRegression().fit(X, y).score(X, y) for y in Y_2d.T],
+        rtol=1e-8, atol=1e-8)
+
+
+def test_one_day_at_a_time_matches_batch():
+    X, Y = make_days()
+    model = IncrementalLinearRegression(X.shape[1], Y.shape[1])
+
+    for day in range(len(X)):
+        model.update(X[day], Y[day])
+        if day + 1 >= 10:
+            assert_matches_batch(model, X[:day + 1], Y[:day + 1])
+
+
+@pytest.mark.parametrize("window", [10, 30])
+def test_window_matches_batch_on_recent_days(window: int):
+    X, Y = make_days()
+    model = IncrementalLinearRegression(X.shape[1], Y.shape[1], window=window)
+
+    for day in range(len(X)):
+        model.update(X[day], Y[day])
+        start = max(day + 1 - window, 0)
+        assert model.n_ == day + 1 - start
+        if day + 1 >= 10:
+            assert_matches_batch(model, X[start:day + 1], Y[start:day + 1])
+
+
+def test_downdate_matches_batch_without_removed_days():
+    X, Y = make_days()
+    model = IncrementalLinearRegression(X.shape[1], Y.shape[1])
+    model.partial_fit(X, Y)
+
+    removed = np.arange(0, len(X), 3)
+    for day in removed:
+        model.downdate(X[day], Y[day])
+
+    kept = np.setdiff1d(np.arange(len(X)), removed)
+    assert model.n_ == len(kept)
+    assert_matches_batch(model, X[kept], Y[kept])
+
+
+def test_single_target_with_scalar_y():
+    X, Y = make_days(n_targets=1)
+    y = Y[:, 0]
+    model = IncrementalLinearRegression(X.shape[1])
+
+    for day in range(len(X)):
+        model.update(X[day], float(y[day]))
+
+    assert model.coef_.shape == (1, X.shape[1])
+    assert model.intercept_.shape == (1,)
+    assert_matches_batch(model, X, y)
+
+    windowed = IncrementalLinearRegression(X.shape[1], window=20)
+    windowed.partial_fit(X, y)
+    assert_matches_batch(windowed, X[-20:], y[-20:])
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Headless rendering of clustering results for large point sets.
+
+Scatter plots draw every point as a separate marker, which takes minutes for
+millions of points. Here the points are instead binned into a fixed size image
+with NumPy: each pixel gets the most common label of its points, and its
+opacity follows the logarithm of the number of points in it. Drawing the image
+costs the same regardless of the number of points.
+
+The figures are drawn with the Agg canvas directly, without pyplot, so that
+rendering to a file works without a display and does not depend on the
+configured matplotlib backend.
+"""
+
+from typing import List, Tuple
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+def rasterize_labels(features: np.array, labels: np.array, bins: int = 512,
+                     extent: Tuple[float, float, float, float] = None) \
+        -> Tuple[np.array, np.array]:
+    """
+    Bins two-dimensional points with labels into an image.
+
+    Parameters:
+    - features: Numpy array of feature data with two columns
+    - labels: Label of each point, -1 for outliers
+    - bins: Width and height of the image in pixels
+    - extent: (xmin, xmax, ymin, ymax) of the image, by default the bounding
+        box of the points
+
+    Returns:
+    - label_image: The most common label of the points in each pixel, with
+        rows from the bottom up. Ties go to the smallest label, and pixels
+        without points get -2.
+    - density: The number of points in each pixel
+    """
+    xmin, xmax, ymin, ymax = extent or (
+        features[:, 0].min(), features[:, 0].max(),
+        features[:, 1].min(), features[:, 1].max())
+
+    # Pixel of each point, with the points on the upper edges in the last
+    # pixel
+    ix = ((features[:, 0] - xmin) / ((xmax - xmin) or 1.0) * bins) \
+        .astype(np.int64).clip(0, bins - 1)
+    iy = ((features[:, 1] - ymin) / ((ymax - ymin) or 1.0) * bins) \
+        .astype(np.int64).clip(0, bins - 1)
+    pixels = iy * bins + ix
+
+    density = np.bincount(pixels, minlength=bins * bins)
+
+    # Count the points per (pixel, label) pair, and take the label with the
+    # most points in each pixel
+    label_values, label_codes = np.unique(labels, return_inverse=True)
+    pairs, pair_counts = np.unique(
+        pixels * label_values.shape[0] + label_codes, return_counts=True)
+    pair_pixels = pairs // label_values.shape[0]
+    order = np.lexsort((-pair_counts, pair_pixels))
+    first = np.flatnonzero(np.diff(pair_pixels[order], prepend=-1))
+
+    label_image = np.full(bins * bins, -2, dtype=np.int64)
+    label_image[pair_pixels[order][first]] = \
+        label_values[pairs[order][first] % label_values.shape[0]]
+
+    return label_image.reshape(bins, bins), density.reshape(bins, bins)
+
+
+def label_image_to_rgba(label_image: np.array, density: np.array,
+                        cmap: str = "viridis") -> np.array:
+    """
+    Colors a label image, with outliers in gray and the opacity of each pixel
+    scaled by the logarithm of its number of points.
+
+    Parameters:
+    - label_image: Label image from rasterize_labels
+    - density: Point counts from rasterize_labels
+    - cmap: Name of the matplotlib colormap for the labels
+
+    Returns:
+    - rgba: Numpy array of RGBA values with shape label_image.shape + (4,)
+    """
+    max_label = max(label_image.max(), 1)
+
+    rgba = matplotlib.colormaps[cmap](label_image / max_label)
+    rgba[label_image == -1] = (0.5, 0.5, 0.5, 1.0)
+
+    log_density = np.log1p(density)
+    rgba[..., 3] = log_density / max(log_density.max(), 1.0)
+    rgba[label_image == -2] = 0.0
+
+    return rgba
+
+
+def render_clusterings(features: np.array, label_sets: List[np.array],
+                       titles: List[str], path: str, bins: int = 512,
+                       columns: int = 2, dpi: int = 100):
+    """
+    Renders the labels of several clusterings of the same points side by side
+    into an image file.
+
+    Parameters:
+    - features: Numpy array of feature data with two columns
+    - label_sets: Labels of each clustering, -1 for outliers
+    - titles: Title of each clustering
+    - path: Path of the image file to write, the format is deduced from the
+        file extension
+    - bins: Width and height of each clustering image in pixels
+    - columns: Number of clusterings per row
+    - dpi: Resolution of the file
+    """
+    extent = (features[:, 0].min(), features[:, 0].max(),
+              features[:, 1].min(), features[:, 1].max())
+    rows = -(-len(label_sets) // columns)
+
+    fig = Figure(figsize=(4 * columns, 4 * rows))
+    FigureCanvasAgg(fig)
+
+    for i, (labels, title) in enumerate(zip(label_sets, titles)):
+        ax = fig.add_subplot(rows, columns, i + 1)
+        label_image, density = rasterize_labels(features, labels, bins,
+                                                extent)
+        ax.imshow(label_image_to_rgba(label_image, density), origin="lower",
+                  extent=extent, aspect="auto", interpolation="nearest")
+        ax.set_title(title)
+
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+Grid-indexed DBSCAN for large two-dimensional point sets.
+
+The points are bucketed into a uniform grid of eps x eps cells. All neighbors
+of a point within eps are in its own cell or in one of the eight cells around
+it, so the candidate pairs are generated cell by cell without a search tree.
+Each pair is visited once, from the cell that is first in the grid order. The
+pairs are processed in chunks of bounded size, which keeps the memory use
+proportional to the number of points rather than the number of neighbor pairs:
+
+1. Count the neighbors of every point to find the core points.
+2. Merge the core points that are within eps of each other with a vectorized
+   union-find, where each round hooks the larger root of every edge to the
+   smaller one and compresses the paths of the edge endpoints with pointer
+   jumping. At the same time collect the core neighbors of the other points,
+   of which there are fewer than min_samples per point.
+3. Assign each border point to the cluster of its nearest-numbered core
+   neighbor.
+
+The labels are the same as the ones given by sklearn.cluster.DBSCAN with the
+euclidean metric, including the numbering of the clusters and the assignment
+of border points that are within eps of several clusters.
+"""
+
+from typing import Iterator, Tuple
+
+import numpy as np
+
+
+# Offsets of the cell itself and the four of the eight cells around it that
+# come after it in the grid order. The other four see the cell forward.
+_OFFSETS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def _find(parent: np.array, nodes: np.array) -> np.array:
+    """
+    Finds the roots of nodes in a union-find forest, compressing the paths of
+    the nodes to point directly to their roots.
+
+    Uses pointer jumping: each round points every node to its grandparent.
+    The nodes along a path are usually among the nodes themselves, e.g. the
+    endpoints of a chain of edges, and then a path of length d is flattened in
+    about log2(d) rounds instead of d. If that takes more rounds than a
+    balanced forest would need, the whole forest is compressed instead, so
+    that long paths through other nodes cannot make the search quadratic.
+    """
+    max_rounds = 2 * int(np.log2(parent.shape[0] + 1)) + 2
+
+    for _ in range(max_rounds):
+        parents = parent[nodes]
+        grandparents = parent[parents]
+        if np.array_equal(grandparents, parents):
+            return parents
+        parent[nodes] = grandparents
+
+    while True:
+        grandparents = parent[parent]
+        if np.array_equal(grandparents, parent):
+            return parent[nodes]
+        parent[:] = grandparents
+
+
+def _union(parent: np.array, u: np.array, v: np.array):
+    """
+    Merges the sets of the endpoints of edges (u, v) in a union-find forest.
+
+    Each round hooks the larger root of every edge under the smaller one, so
+    the root of a set is always its smallest node, and repeats with the edges
+    whose endpoints are still in different sets.
+    """
+    while u.shape[0] > 0:
+        root_u, root_v = _find(parent, u), _find(parent, v)
+        apart = root_u != root_v
+        u, v = u[apart], v[apart]
+        root_u, root_v = root_u[apart], root_v[apart]
+
+        np.minimum.at(parent, np.maximum(root_u, root_v),
+                      np.minimum(root_u, root_v))
+
+
+class GridDBSCAN:
+    """
+    DBSCAN clustering of two-dimensional data using a uniform grid index.
+
+    Can be used in place of sklearn.cluster.DBSCAN for two-dimensional
+    features with the euclidean metric.
+
+    Parameters:
+    - eps: The max distance between two samples to consider them neighbors
+    - min_samples: The number of samples, including the sample itself, within
+        eps for a sample to be a core sample
+    - chunk_size: Approximate number of candidate pairs to process at a time
+    """
+
+    def __init__(self, eps: float = 0.5, min_samples: int = 5,
+                 chunk_size: int = 2**22):
+        self.eps = eps
+        self.min_samples = min_samples
+        self.chunk_size = chunk_size
+
+    def _build_grid(self, X: np.array):
+        """
+        Sorts the points by grid cell and finds the neighboring cells of
+        each cell.
+        """
+        cells = np.floor((X - X.min(axis=0)) / self.eps).astype(np.int64)
+
+        # One empty row and column of margin, so that the offsets of edge
+        # cells do not wrap around to the other side of the grid
+        n_rows = cells[:, 1].max() + 3
+        keys = (cells[:, 0] + 1) * n_rows + cells[:, 1] + 1
+
+        self._order = np.argsort(keys, kind="stable")
+        self._x = X[self._order, 0]
+        self._y = X[self._order, 1]
+
+        cell_keys, self._cell_start, self._cell_size = np.unique(
+            keys[self._order], return_index=True, return_counts=True)
+        self._point_cell = np.repeat(np.arange(cell_keys.shape[0]),
+                                     self._cell_size)
+
+        # Index of each neighboring cell, -1 for empty cells
+        self._neighbor_cells = np.full((cell_keys.shape[0], len(_OFFSETS)), -1)
+        for k, (dx, dy) in enumerate(_OFFSETS):
+            target = cell_keys + dx * n_rows + dy
+            pos = np.minimum(np.searchsorted(cell_keys, target),
+                             cell_keys.shape[0] - 1)
+            found = cell_keys[pos] == target
+            self._neighbor_cells[found, k] = pos[found]
+
+        # Number of candidate pairs of a point in each cell
+        self._cell_candidates = np.where(
+            self._neighbor_cells >= 0,
+            self._cell_size[self._neighbor_cells], 0).sum(axis=1)
+
+    def _neighbor_pairs(self) -> Iterator[Tuple[np.array, np.array]]:
+        """
+        Yields the pairs of distinct points within eps of each other, each
+        pair once, in chunks of about chunk_size candidate pairs.
+
+        Yields:
+        - rows: Positions of the first points of the pairs in the sorted
+            points
+        - cols: Positions of the second points of the pairs
+        """
+        n_points = self._x.shape[0]
+        candidates = self._cell_candidates[self._point_cell]
+        chunk_ids = np.cumsum(candidates) // self.chunk_size
+        bounds = np.flatnonzero(np.diff(chunk_ids)) + 1
+        eps_squared = self.eps ** 2
+
+        for chunk in np.split(np.arange(n_points), bounds):
+            for k in range(len(_OFFSETS)):
+                cells = self._neighbor_cells[self._point_cell[chunk], k]
+                has_cell = cells >= 0
+                rows, cells = chunk[has_cell], cells[has_cell]
+
+                # Pair each point with every point of the neighboring cell
+                sizes = self._cell_size[cells]
+                first = np.cumsum(sizes) - sizes
+                rows = np.repeat(rows, sizes)
+                cols = np.arange(rows.shape[0]) - np.repeat(first, sizes) + \
+                    np.repeat(self._cell_start[cells], sizes)
+
+                if k == 0:
+                    # Within the cell, each pair once and without the point
+                    # itself
+                    forward = cols > rows
+                    rows, cols = rows[forward], cols[forward]
+
+                dx = self._x[rows] - self._x[cols]
+                dy = self._y[rows] - self._y[cols]
+                within = dx * dx + dy * dy <= eps_squared
+
+                yield rows[within], cols[within]
+
+    def fit(self, X: np.array, y=None):
+        """
+        Performs DBSCAN clustering.
+
+        Parameters:
+        - X: Numpy array of feature data with two columns
+        - y: Ignored, present for API consistency with sklearn
+
+        Returns:
+        - self: The fitted model, with the cluster labels in labels_ (-1 for
+            outliers), the indices of the core samples in
+            core_sample_indices_ and the core samples in components_
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != 2:
+            raise ValueError(
+                f"GridDBSCAN supports only two-dimensional data, got data "
+                f"with shape {X.shape}")
+
+        n_points = X.shape[0]
+        self.labels_ = np.full(n_points, -1, dtype=np.int64)
+        if n_points == 0:
+            self.core_sample_indices_ = np.empty(0, dtype=np.int64)
+            self.components_ = np.empty((0, 2))
+            return self
+
+        self._build_grid(X)
+
+        # Neighbor counts, including the points themselves
+        counts = np.ones(n_points, dtype=np.int64)
+        for rows, cols in self._neighbor_pairs():
+            counts += np.bincount(rows, minlength=n_points)
+            counts += np.bincount(cols, minlength=n_points)
+        core = counts >= self.min_samples
+
+        # Merge core neighbors. The union-find works with the original
+        # indices, so that each root is the first point of its cluster.
+        parent = np.arange(n_points)
+        border_edges = []
+        for rows, cols in self._neighbor_pairs():
+            core_rows, core_cols = core[rows], core[cols]
+            both = core_rows & core_cols
+            _union(parent, self._order[rows[both]], self._order[cols[both]])
+
+            border_edges.append((rows[core_cols & ~core_rows],
+                                 cols[core_cols & ~core_rows]))
+            border_edges.append((cols[core_rows & ~core_cols],
+                                 rows[core_rows & ~core_cols]))
+
+        core_indices = np.sort(self._order[core])
+        roots = _find(parent, core_indices)
+
+        # Border points join the cluster with the smallest root among their
+        # core neighbors, which DBSCAN expands first
+        border_roots = np.full(n_points, n_points)
+        if border_edges:
+            borders, neighbors = (np.concatenate(a)
+                                  for a in zip(*border_edges))
+            np.minimum.at(border_roots, self._order[borders],
+                          parent[self._order[neighbors]])
+
+        # Number the clusters in the order of their first point
+        cluster_roots = np.unique(roots)
+        self.labels_[core_indices] = np.searchsorted(cluster_roots, roots)
+        border = border_roots < n_points
+        self.labels_[border] = np.searchsorted(cluster_roots,
+                                               border_roots[border])
+
+        self.core_sample_indices_ = core_indices
+        self.components_ = X[core_indices]
+
+        del self._order, self._x, self._y, self._point_cell
+        del self._cell_start, self._cell_size
+        del self._neighbor_cells, self._cell_candidates
+
+        return self
+
+    def fit_predict(self, X: np.array, y=None) -> np.array:
+        """
+        Performs DBSCAN clustering and returns the cluster labels.
+
+        Parameters:
+        - X: Numpy array of feature data with two columns
+        - y: Ignored, present for API consistency with sklearn
+
+        Returns:
+        - labels: Cluster labels, -1 for outliers
+        """
+        return self.fit(X).labels_
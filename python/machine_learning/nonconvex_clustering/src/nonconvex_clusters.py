@@ -35,15 +35,26 @@ colored) to see what kind of data we are dealing with.
 Points are given for each correct column in the result DataFrame.
 """
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Tuple
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import scipy
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.csgraph
 from sklearn.cluster import DBSCAN
+from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import accuracy_score
 
+from cluster_plots import render_clusterings
+
+
+# State of a worker process of dbscan_grid_search, set up by _init_worker
+_worker = {}
+
 
 def load_data() -> Tuple[np.array, np.array]:
     """
@@ -67,52 +78,67 @@ def load_data() -> Tuple[np.array, np.array]:
 
 
 def find_permutation(n_clusters: int, real_labels: np.array,
-                     pred_labels: np.array) -> (List[int], np.array):
+                     pred_labels: np.array, optimal: bool = False) \
+        -> (List[int], np.array):
     """
     Gets a permutation of predicted labels so that the scheme of the model's
     predicted labels matches the scheme of the original labels.
 
+    The cluster x label contingency table is counted in one np.bincount call,
+    and each cluster is mapped to the real label it shares most points with.
+    The mapping is applied to all points at once by indexing the permutation
+    with the predicted labels.
+
     NOTE: For the purposes of this assignment, we ignore the data points
     that DBSCAN identifies as outliers both from real_labels and pred_labels.
-    The implementation itself works fine even if you do not ignore the outliers,
-    as they are given a value of -1.
+    The implementation itself works fine even if you do not ignore the
+    outliers: points with the predicted label -1 keep the label -1.
 
     Parameters:
     - n_clusters: Number of clusters for which to perform the relabeling
     - real_labels: The original labels for each data point
     - labels: The predicted labels for each data point
+    - optimal: If True, clusters are matched to labels one-to-one with the
+        Hungarian algorithm so that the total number of matching points is
+        maximized. Clusters left without a label, when there are more clusters
+        than labels, fall back to their most common label.
 
     Returns:
     - permutation: New labeling scheme for predicted labels to match the scheme
         of labels
     - new_labels: New labeling for predicted labels
     """
-    permutation = []
+    real_values, real_codes = np.unique(real_labels, return_inverse=True)
+    n_labels = real_values.shape[0]
 
-    # For each predicted cluster, we want to assign an new label
-    for i in range(n_clusters):
+    # Count points per (predicted cluster, real label) pair, ignoring outliers
+    pred_labels = np.asarray(pred_labels)
+    clustered = (pred_labels >= 0) & (pred_labels < n_clusters)
+    contingency = np.bincount(
+        pred_labels[clustered] * n_labels + real_codes[clustered],
+        minlength=n_clusters * n_labels).reshape(n_clusters, n_labels)
 
-        # Get the points from the predicted clusters with the currently
-        # evaluated label
-        idx = pred_labels == i
+    # The most common real label of each cluster. Ties go to the smallest
+    # label, like with scipy.stats.mode.
+    label_codes = contingency.argmax(axis=1)
 
-        # Get the corresponding data points from real labels. The new label
-        # to use is the most common of the real labels found.
-        new_label = scipy.stats.mode(real_labels[idx])[0][0]
+    if optimal:
+        clusters, labels = scipy.optimize.linear_sum_assignment(
+            contingency, maximize=True)
+        label_codes[clusters] = labels
 
-        # Append the new label to list. This list will be used to replace the
-        # model's assigned labels pointwise.
-        permutation.append(new_label)
+    permutation = real_values[label_codes]
 
     # Create a new array of predicted labels with the same labeling scheme as
     # the original labels
-    new_labels = [permutation[label]
-                  for label in pred_labels]  # permute the labels
+    new_labels = np.where(pred_labels >= 0,
+                          permutation[np.clip(pred_labels, 0, None)], -1)
 
-    return permutation, new_labels
+    return permutation.tolist(), new_labels
 
 
-def train_and_evaluate_dbscan(eps: float, features: np.array, labels: np.array):
+def train_and_evaluate_dbscan(eps: float, features: np.array, labels: np.array,
+                              min_samples: int = 5, estimator: type = DBSCAN):
     """
     Trains a DBSCAN model with the given eps parameter and features, compares
     results against real labels, and returns evaluation data.
@@ -127,6 +153,10 @@ def train_and_evaluate_dbscan(eps: float, features: np.array, labels: np.array):
         distance between to samples to consider them part of the same cluster
     - features: Numpy array of feature data with which to train the DBSCAN model
     - labels: Real labels against which to evaluate the DBSCAN model
+    - min_samples: min_samples parameter value to use when training the DBSCAN
+        model
+    - estimator: DBSCAN implementation to use, sklearn's DBSCAN or GridDBSCAN
+        for large two-dimensional datasets
 
     Returns:
     - eps: The eps value used for this run
@@ -136,10 +166,29 @@ def train_and_evaluate_dbscan(eps: float, features: np.array, labels: np.array):
     """
 
     # Train DBSCAN model
-    model = DBSCAN(eps=eps)
+    model = estimator(eps=eps, min_samples=min_samples)
     model.fit(features)
 
-    pred_labels = model.labels_
+    return evaluate_clustering(eps, model.labels_, labels)
+
+
+def evaluate_clustering(eps: float, pred_labels: np.array, labels: np.array):
+    """
+    Compares DBSCAN cluster labels against real labels and returns evaluation
+    data, see train_and_evaluate_dbscan.
+
+    Parameters:
+    - eps: eps parameter value the DBSCAN model was trained with
+    - pred_labels: Cluster labels given by DBSCAN, -1 for outliers
+    - labels: Real labels against which to evaluate the DBSCAN model
+
+    Returns:
+    - eps: The eps value used for this run
+    - score: The accuracy score with outliers ignored
+    - clusters: The number of clusters identified by DBSCAN
+    - outliers: The number of outliers identified by DBSCAN
+    - pred_labels: The cluster labels given by DBSCAN
+    """
     pred_outliers = pred_labels == -1
     pred_outliers_count = pred_outliers.sum()
 
@@ -162,14 +211,206 @@ def train_and_evaluate_dbscan(eps: float, features: np.array, labels: np.array):
     return eps, score, pred_clusters_count, pred_outliers_count, pred_labels
 
 
-def nonconvex_clusters() -> pd.DataFrame:
+def dbscan_labels_from_edges(rows: np.array, neighbors: np.array,
+                             n_points: int, min_samples: int = 5) -> np.array:
+    """
+    Computes DBSCAN cluster labels from the edges of a radius neighbors graph.
+
+    The labels are the same as the ones given by DBSCAN with the radius of the
+    graph as eps. Core points are the points with at least min_samples points,
+    including themselves, within eps. Clusters are the connected components of
+    the core points, numbered in the order of their first core point. A border
+    point belongs to the cluster with the smallest number among its core
+    neighbors, since DBSCAN expands the clusters in that order and does not
+    reassign points. The rest of the points are outliers.
+
+    Parameters:
+    - rows: Point of each edge, in ascending order
+    - neighbors: Neighbor of each edge. Both directions of each edge are
+        included, and points are not their own neighbors.
+    - n_points: Number of points
+    - min_samples: min_samples parameter of DBSCAN
+
+    Returns:
+    - pred_labels: Cluster labels, -1 for outliers
+    """
+    core = np.bincount(rows, minlength=n_points) + 1 >= min_samples
+
+    # Connected components of the graph restricted to core points. The graph
+    # is symmetric, so the strong components equal the undirected ones without
+    # symmetrizing the graph first.
+    core_edges = core[rows] & core[neighbors]
+    core_indptr = np.zeros(n_points + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[core_edges], minlength=n_points),
+              out=core_indptr[1:])
+    core_graph = scipy.sparse.csr_matrix(
+        (np.ones(core_edges.sum(), dtype=np.int8), neighbors[core_edges],
+         core_indptr),
+        shape=(n_points, n_points))
+    _, components = scipy.sparse.csgraph.connected_components(
+        core_graph, directed=True, connection="strong")
+
+    # Renumber the components of core points in the order of their first core
+    # point
+    core_components = components[core]
+    _, first = np.unique(core_components, return_index=True)
+    rank = np.zeros(components.max() + 1, dtype=np.int64)
+    rank[core_components[np.sort(first)]] = np.arange(first.shape[0])
+
+    pred_labels = np.full(n_points, -1, dtype=np.int64)
+    pred_labels[core] = rank[core_components]
+
+    # Border points get the smallest cluster number of their core neighbors
+    neighbor_labels = pred_labels[neighbors]
+    border = ~core[rows] & (neighbor_labels >= 0)
+    border_labels = np.full(n_points, n_points)
+    np.minimum.at(border_labels, rows[border], neighbor_labels[border])
+    has_cluster = ~core & (border_labels < n_points)
+    pred_labels[has_cluster] = border_labels[has_cluster]
+
+    return pred_labels
+
+
+def dbscan_eps_sweep(features: np.array, eps_values: np.array,
+                     min_samples: int = 5) -> List[np.array]:
+    """
+    Clusters the features with DBSCAN for several eps values, reusing one
+    neighborhood graph.
+
+    The sparse radius neighbors graph is computed once for the largest eps.
+    The graph for a smaller eps is the same graph without the edges longer
+    than eps, so it is derived by thresholding the stored distances. The eps
+    values are processed from the largest to the smallest, and each graph is
+    thresholded from the previous one, so the graphs get smaller as the sweep
+    goes on. This way the neighbor queries are done only once for the whole
+    sweep. The labels are the same as with
+    DBSCAN(eps=eps, min_samples=min_samples).
+
+    Parameters:
+    - features: Numpy array of feature data
+    - eps_values: eps values to cluster with
+    - min_samples: min_samples parameter of DBSCAN
+
+    Returns:
+    - pred_labels_all: List of cluster label arrays, one per eps value
+    """
+    graph = NearestNeighbors(radius=np.max(eps_values)) \
+        .fit(features) \
+        .radius_neighbors_graph(mode="distance")
+
+    # Edges in row-major order, which keeps the memory access sequential
+    distances = graph.data
+    rows = np.repeat(np.arange(graph.shape[0]), np.diff(graph.indptr))
+    neighbors = graph.indices
+
+    pred_labels_all = [None] * len(eps_values)
+    for i in np.argsort(eps_values)[::-1]:
+        keep = distances <= eps_values[i]
+        distances, rows, neighbors = \
+            distances[keep], rows[keep], neighbors[keep]
+
+        pred_labels_all[i] = dbscan_labels_from_edges(
+            rows, neighbors, graph.shape[0], min_samples)
+
+    return pred_labels_all
+
+
+def _init_worker(features: np.array, labels: np.array, estimator: type):
+    """
+    Stores the dataset in a worker process of dbscan_grid_search.
+    """
+    _worker["features"] = features
+    _worker["labels"] = labels
+    _worker["estimator"] = estimator
+
+
+def _evaluate(i: int, eps: float, min_samples: int) -> tuple:
+    """
+    Evaluates one grid point in a worker process of dbscan_grid_search. The
+    cluster labels are not returned, to keep the results small.
+    """
+    _, score, clusters, outliers, _ = train_and_evaluate_dbscan(
+        eps, _worker["features"], _worker["labels"], min_samples,
+        _worker["estimator"])
+
+    return i, score, clusters, outliers
+
+
+def dbscan_grid_search(features: np.array, labels: np.array,
+                       eps_values: np.array, min_samples_values: tuple = (5,),
+                       n_jobs: int = None, verbose: bool = True,
+                       estimator: type = DBSCAN) -> pd.DataFrame:
+    """
+    Evaluates DBSCAN models with every combination of eps and min_samples in
+    parallel.
+
+    Each combination is evaluated with train_and_evaluate_dbscan in a pool of
+    worker processes, which receive the dataset once when they start. The
+    results are written into preallocated arrays as they complete, and the
+    DataFrame is built from them at the end.
+
+    Parameters:
+    - features: Numpy array of feature data
+    - labels: Real labels against which to evaluate the DBSCAN models
+    - eps_values: eps values to evaluate
+    - min_samples_values: min_samples values to evaluate
+    - n_jobs: Number of worker processes, by default the number of CPUs
+    - verbose: Whether to print the progress
+    - estimator: DBSCAN implementation to use, see train_and_evaluate_dbscan
+
+    Returns:
+    - result_df: Pandas DataFrame with one row per combination, with the eps
+        and min_samples values, accuracy score, and the number of clusters and
+        outliers identified by DBSCAN
+    """
+    grid_eps, grid_min_samples = (a.ravel() for a in np.meshgrid(
+        eps_values, min_samples_values, indexing="ij"))
+    n_combinations = grid_eps.shape[0]
+
+    scores = np.full(n_combinations, np.nan)
+    clusters = np.zeros(n_combinations, dtype=np.int64)
+    outliers = np.zeros(n_combinations, dtype=np.int64)
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(features, labels,
+                                       estimator)) as executor:
+        futures = [executor.submit(_evaluate, i, eps, int(min_samples))
+                   for i, (eps, min_samples) in
+                   enumerate(zip(grid_eps, grid_min_samples))]
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            i, score, clusters[i], outliers[i] = future.result()
+            if score is not None:
+                scores[i] = score
+
+            if verbose:
+                print(f"\rEvaluated {done}/{n_combinations} combinations",
+                      end="\n" if done == n_combinations else "",
+                      flush=True)
+
+    return pd.DataFrame({
+        "eps": grid_eps,
+        "min_samples": grid_min_samples,
+        "Score": scores,
+        "Clusters": clusters,
+        "Outliers": outliers
+    })
+
+
+def nonconvex_clusters(plot: str = "show",
+                       plot_path: str = "src/nonconvex_clusters.png") \
+        -> pd.DataFrame:
     """
     Evaluates DBSCAN models with different EPS values on a given dataset.
 
     Also visualizes the clustering results given by DBSCAN.
 
     Parameters:
-    None
+    - plot: How to visualize the results. "show" shows scatter plots in a
+        window, "file" renders the points as images with cluster_plots and
+        writes them to plot_path without a display, and "none" skips the
+        visualization.
+    - plot_path: Path of the image file to write with plot="file"
 
     Returns:
     - result_df: Pandas DataFrame with the eps value, accuracy score, and the
@@ -178,30 +419,48 @@ def nonconvex_clusters() -> pd.DataFrame:
     features, labels = load_data()
 
     eps_values = np.arange(0.05, 0.2, 0.05)
-    result_df = pd.DataFrame(columns=["eps", "Score", "Clusters", "Outliers"])
+    scores = np.full(eps_values.shape[0], np.nan)
+    clusters_counts = np.zeros(eps_values.shape[0], dtype=np.int64)
+    outliers_counts = np.zeros(eps_values.shape[0], dtype=np.int64)
     pred_labels_all = np.empty((labels.shape[0], eps_values.shape[0]))
 
+    # Cluster with all eps values using a shared neighborhood graph
+    pred_labels_sweep = dbscan_eps_sweep(features, eps_values)
+
     for i, eps in enumerate(eps_values):
         eps, score, clusters, outliers, pred_labels = \
-            train_and_evaluate_dbscan(eps, features, labels)
-
-        result_dict = {
-            "eps": eps,
-            "Score": score,
-            "Clusters": clusters,
-            "Outliers": outliers
-        }
+            evaluate_clustering(eps, pred_labels_sweep[i], labels)
 
-        result_df = result_df.append(result_dict, ignore_index=True)
+        if score is not None:
+            scores[i] = score
+        clusters_counts[i] = clusters
+        outliers_counts[i] = outliers
         pred_labels_all[:, i] = pred_labels
 
-    fig, ax = plt.subplots(3, 2)
-    ax[0, 0].scatter(features[:, 0], features[:, 1], c=labels)
-    ax[1, 0].scatter(features[:, 0], features[:, 1], c=pred_labels_all[:, 0])
-    ax[1, 1].scatter(features[:, 0], features[:, 1], c=pred_labels_all[:, 1])
-    ax[2, 0].scatter(features[:, 0], features[:, 1], c=pred_labels_all[:, 2])
-    ax[2, 1].scatter(features[:, 0], features[:, 1], c=pred_labels_all[:, 3])
-    plt.show()
+    result_df = pd.DataFrame({
+        "eps": eps_values,
+        "Score": scores,
+        "Clusters": clusters_counts,
+        "Outliers": outliers_counts
+    })
+
+    if plot == "show":
+        x, y = features[:, 0], features[:, 1]
+        fig, ax = plt.subplots(3, 2)
+        ax[0, 0].scatter(x, y, c=labels)
+        ax[1, 0].scatter(x, y, c=pred_labels_all[:, 0])
+        ax[1, 1].scatter(x, y, c=pred_labels_all[:, 1])
+        ax[2, 0].scatter(x, y, c=pred_labels_all[:, 2])
+        ax[2, 1].scatter(x, y, c=pred_labels_all[:, 3])
+        plt.show()
+    elif plot == "file":
+        render_clusterings(
+            features, [labels] + list(pred_labels_all.T.astype(np.int64)),
+            ["Real labels"] + [f"eps = {eps:.2f}" for eps in eps_values],
+            plot_path, bins=128)
+    elif plot != "none":
+        raise ValueError(
+            f"plot must be 'show', 'file' or 'none', got {plot!r}")
 
     return result_df
 
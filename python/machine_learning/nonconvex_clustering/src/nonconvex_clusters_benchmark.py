@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the nonconvex clusters exercise.
+
+Run from the nonconvex_clustering folder like the exercise itself, so that the
+relative paths to the source data in src resolve:
+
+    python src/nonconvex_clusters_benchmark.py
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from sklearn.cluster import DBSCAN
+from sklearn.datasets import make_moons
+
+from cluster_plots import render_clusterings
+from grid_dbscan import GridDBSCAN
+from nonconvex_clusters import (dbscan_eps_sweep, dbscan_grid_search,
+                                find_permutation, load_data,
+                                train_and_evaluate_dbscan)
+
+
+def find_permutation_rowwise(n_clusters: int, real_labels: np.array,
+                             pred_labels: np.array) -> (List[int], list):
+    """
+    The original implementation of find_permutation with one scipy.stats.mode
+    call per cluster and a Python level relabeling, kept as the baseline for
+    benchmarking.
+    """
+    permutation = []
+    for i in range(n_clusters):
+        idx = pred_labels == i
+        new_label = np.atleast_1d(
+            scipy.stats.mode(real_labels[idx])[0])[0]
+        permutation.append(new_label)
+
+    new_labels = [permutation[label] for label in pred_labels]
+
+    return permutation, new_labels
+
+
+def timed(func: Callable, *args, **kwargs) -> Tuple[object, float]:
+    """
+    Runs a function once and measures its wall clock time.
+
+    Parameters:
+    - func: Function to measure
+    - args, kwargs: Arguments passed on to func
+
+    Returns:
+    - result: Return value of func
+    - seconds: Wall clock time of the call in seconds
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_find_permutation(
+        sizes: tuple = ((10_000, 10), (1_000_000, 1000)),
+        n_labels: int = 1000, random_state: int = 0) -> pd.DataFrame:
+    """
+    Compares find_permutation, with and without optimal assignment, against
+    the original implementation on random labelings where the predicted
+    clusters mostly agree with the real labels.
+
+    Parameters:
+    - sizes: Pairs of number of points and number of clusters
+    - n_labels: Maximum number of real labels
+    - random_state: Seed for the random labels
+
+    Returns:
+    - result_df: DataFrame with the time of each implementation per size
+    """
+    rng = np.random.RandomState(random_state)
+    rows = []
+
+    for n_points, n_clusters in sizes:
+        real_labels = rng.randint(0, min(n_labels, n_clusters), n_points)
+
+        # Predicted clusters are a shuffled version of the real labels with
+        # 10% of the points assigned to a random cluster
+        pred_labels = rng.permutation(n_clusters)[
+            real_labels % n_clusters]
+        noise = rng.random_sample(n_points) < 0.1
+        pred_labels[noise] = rng.randint(0, n_clusters, noise.sum())
+
+        expected, rowwise_seconds = timed(
+            find_permutation_rowwise, n_clusters, real_labels, pred_labels)
+        result, vectorized_seconds = timed(
+            find_permutation, n_clusters, real_labels, pred_labels)
+        _, optimal_seconds = timed(
+            find_permutation, n_clusters, real_labels, pred_labels,
+            optimal=True)
+
+        rows.append({
+            "points": n_points,
+            "clusters": n_clusters,
+            "rowwise_s": rowwise_seconds,
+            "vectorized_s": vectorized_seconds,
+            "optimal_s": optimal_seconds,
+            "speedup": rowwise_seconds / vectorized_seconds,
+            "equal": np.array_equal(result[1], expected[1])
+        })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_eps_sweep(n_eps: int = 50, n_synthetic: int = 20_000,
+                        random_state: int = 0) -> pd.DataFrame:
+    """
+    Compares dbscan_eps_sweep against fitting DBSCAN separately for each eps
+    value, on the bundled data and on a larger synthetic two moons dataset.
+
+    Parameters:
+    - n_eps: Number of eps values in the grid
+    - n_synthetic: Number of points in the synthetic dataset
+    - random_state: Seed for the synthetic dataset
+
+    Returns:
+    - result_df: DataFrame with the time of both approaches per dataset
+    """
+    features, _ = load_data()
+    moons, _ = make_moons(n_synthetic, noise=0.05, random_state=random_state)
+
+    rows = []
+    for name, data, eps_values in (
+            ("data.tsv", features, np.linspace(0.01, 0.2, n_eps)),
+            ("moons", moons, np.linspace(0.005, 0.05, n_eps))):
+        expected, separate_seconds = timed(
+            lambda: [DBSCAN(eps=eps).fit(data).labels_
+                     for eps in eps_values])
+        result, sweep_seconds = timed(dbscan_eps_sweep, data, eps_values)
+
+        rows.append({
+            "dataset": name,
+            "points": data.shape[0],
+            "eps_values": n_eps,
+            "separate_s": separate_seconds,
+            "sweep_s": sweep_seconds,
+            "speedup": separate_seconds / sweep_seconds,
+            "equal": all(np.array_equal(a, b)
+                         for a, b in zip(result, expected))
+        })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_grid_search(n_eps: int = 40,
+                          min_samples_values: tuple = (2, 5, 10, 20, 40),
+                          n_jobs_values: tuple = (1, 2, 4)) -> pd.DataFrame:
+    """
+    Compares evaluating an eps x min_samples grid on the bundled data in a
+    serial loop of train_and_evaluate_dbscan against dbscan_grid_search with
+    different numbers of worker processes.
+
+    Parameters:
+    - n_eps: Number of eps values in the grid
+    - min_samples_values: min_samples values in the grid
+    - n_jobs_values: Numbers of worker processes to run the grid search with
+
+    Returns:
+    - result_df: DataFrame with the time of each setup
+    """
+    features, labels = load_data()
+    eps_values = np.linspace(0.01, 0.2, n_eps)
+
+    def serial() -> np.array:
+        return np.array([
+            train_and_evaluate_dbscan(eps, features, labels, min_samples)[2]
+            for eps in eps_values for min_samples in min_samples_values])
+
+    expected, serial_seconds = timed(serial)
+    rows = [{"setup": "serial", "combinations": expected.shape[0],
+             "seconds": serial_seconds, "speedup": 1.0, "equal": True}]
+
+    for n_jobs in n_jobs_values:
+        result_df, seconds = timed(
+            dbscan_grid_search, features, labels, eps_values,
+            min_samples_values, n_jobs=n_jobs, verbose=False)
+
+        rows.append({
+            "setup": f"grid_search n_jobs={n_jobs}",
+            "combinations": result_df.shape[0],
+            "seconds": seconds,
+            "speedup": serial_seconds / seconds,
+            "equal": np.array_equal(result_df["Clusters"], expected)
+        })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_grid_dbscan(sizes: tuple = (200_000, 2_000_000),
+                          chain_sizes: tuple = (20_000, 80_000, 320_000),
+                          random_state: int = 0) -> pd.DataFrame:
+    """
+    Checks that GridDBSCAN gives the same labels as sklearn's DBSCAN on the
+    bundled data for several eps and min_samples values, and compares the time
+    and peak memory of both on large synthetic two moons datasets. eps is
+    scaled with the number of points to keep the neighborhoods about the same
+    size.
+
+    The points of the two moons datasets are in random order. As a case where
+    the union-find builds long chains, both are also run on points ordered
+    along a line, 0.4 * eps apart, like the points of a trajectory.
+
+    Parameters:
+    - sizes: Numbers of points in the synthetic two moons datasets
+    - chain_sizes: Numbers of points in the ordered chain datasets
+    - random_state: Seed for the synthetic datasets
+
+    Returns:
+    - result_df: DataFrame with the time, peak memory and number of clusters
+        of both implementations per dataset
+    """
+    features, labels = load_data()
+    bundled_equal = all(
+        np.array_equal(
+            train_and_evaluate_dbscan(eps, features, labels, min_samples,
+                                      estimator=GridDBSCAN)[4],
+            train_and_evaluate_dbscan(eps, features, labels, min_samples)[4])
+        for eps in np.linspace(0.01, 0.3, 30) for min_samples in (2, 5, 20))
+    print(f"GridDBSCAN labels equal to DBSCAN on data.tsv: {bundled_equal}")
+
+    datasets = []
+    for n_points in sizes:
+        moons, _ = make_moons(n_points, noise=0.05,
+                              random_state=random_state)
+        datasets.append(("moons", moons, 0.01 * np.sqrt(200_000 / n_points)))
+    for n_points in chain_sizes:
+        chain = np.column_stack((np.arange(n_points) * 0.4,
+                                 np.zeros(n_points)))
+        datasets.append(("chain", chain, 1.0))
+
+    rows = []
+    for dataset, points, eps in datasets:
+        labels_by_estimator = {}
+        for estimator in (DBSCAN, GridDBSCAN):
+            tracemalloc.start()
+            model, seconds = timed(estimator(eps=eps).fit, points)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            labels_by_estimator[estimator] = model.labels_
+            rows.append({
+                "dataset": dataset,
+                "points": points.shape[0],
+                "eps": eps,
+                "estimator": estimator.__name__,
+                "seconds": seconds,
+                "peak_mb": peak_bytes / 2**20,
+                "clusters": model.labels_.max() + 1,
+                "equal": np.array_equal(labels_by_estimator[DBSCAN],
+                                        model.labels_)
+            })
+
+    return pd.DataFrame(rows)
+
+
+def render_scatter(features: np.array, labels: np.array, path: str):
+    """
+    Renders a scatter plot of labeled points into an image file with the Agg
+    canvas, as the baseline for benchmarking render_clusterings.
+    """
+    fig = Figure(figsize=(4, 4))
+    FigureCanvasAgg(fig)
+    fig.add_subplot().scatter(features[:, 0], features[:, 1], c=labels)
+    fig.savefig(path, dpi=100)
+
+
+def benchmark_rendering(sizes: tuple = (10_000, 100_000, 1_000_000),
+                        random_state: int = 0) -> pd.DataFrame:
+    """
+    Compares rendering labeled two moons datasets as a scatter plot against
+    the rasterized rendering of render_clusterings, both into PNG files.
+
+    Parameters:
+    - sizes: Numbers of points in the datasets
+    - random_state: Seed for the datasets
+
+    Returns:
+    - result_df: DataFrame with the rendering time of both approaches per
+        dataset size
+    """
+    rows = []
+
+    with tempfile.TemporaryDirectory() as plot_dir:
+        for n_points in sizes:
+            moons, labels = make_moons(n_points, noise=0.05,
+                                       random_state=random_state)
+
+            _, scatter_seconds = timed(
+                render_scatter, moons, labels,
+                os.path.join(plot_dir, "scatter.png"))
+            _, raster_seconds = timed(
+                render_clusterings, moons, [labels], ["Labels"],
+                os.path.join(plot_dir, "raster.png"), columns=1)
+
+            rows.append({
+                "points": n_points,
+                "scatter_s": scatter_seconds,
+                "raster_s": raster_seconds,
+                "speedup": scatter_seconds / raster_seconds
+            })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    """
+    Main function, runs the benchmarks and prints the results.
+    """
+    print(benchmark_find_permutation())
+    print(benchmark_eps_sweep())
+    print(benchmark_grid_search())
+    print(benchmark_grid_dbscan())
+    print(benchmark_rendering())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+On-disk artifact cache for the spam detection exercise.
+
+Fitting the spam models means reading, tokenizing and vectorizing the whole
+corpus. The fitted vectorizers, feature matrices and models only depend on the
+contents of the source data files and a few parameters, so they can be stored
+on disk and loaded on the next run with the same inputs instead.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from typing import Dict, List, Optional
+
+
+# Content hashes of already hashed files, keyed by path, size and modification
+# time, so that a file is hashed at most once per process unless it changes
+_file_hashes: Dict[tuple, str] = {}
+
+
+def file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 hash of the contents of a file.
+
+    Parameters:
+    - path: Path to the file
+
+    Returns:
+    - digest: Hex digest of the file contents
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    if memo_key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                sha.update(block)
+        _file_hashes[memo_key] = sha.hexdigest()
+
+    return _file_hashes[memo_key]
+
+
+class ArtifactCache:
+    """
+    Stores pickled artifacts in a directory, keyed by the contents of source
+    data files and parameters.
+
+    Each entry is a single pickle file. Reading an entry updates its
+    modification time, and when the total size of the entries exceeds
+    max_bytes, the least recently used entries are removed first.
+    """
+
+    def __init__(self, directory: str = "src/.spam_cache",
+                 max_bytes: int = 512 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, paths: List[str], **params) -> str:
+        """
+        Creates a cache key from the contents of source files and parameters.
+
+        Parameters:
+        - paths: Paths to the source data files the artifacts are created from
+        - params: Parameters that affect the artifacts, e.g. fraction and
+            random_state. Values need to be JSON serializable.
+
+        Returns:
+        - key: Hex digest identifying the inputs
+        """
+        key_data = {
+            "files": [file_hash(path) for path in paths],
+            "params": params
+        }
+        key_json = json.dumps(key_data, sort_keys=True)
+
+        return hashlib.sha256(key_json.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Loads the artifacts stored with a key.
+
+        Parameters:
+        - key: Cache key from ArtifactCache.key
+
+        Returns:
+        - artifacts: Dictionary of the stored artifacts, or None if there is no
+            entry for the key
+        """
+        path = self._entry_path(key)
+
+        try:
+            with open(path, "rb") as f:
+                artifacts = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path)
+
+        return artifacts
+
+    def put(self, key: str, artifacts: dict):
+        """
+        Stores artifacts with a key and evicts least recently used entries if
+        the cache has grown too large.
+
+        Parameters:
+        - key: Cache key from ArtifactCache.key
+        - artifacts: Dictionary of picklable artifacts
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._entry_path(key)
+
+        # Write to a temporary file first, so that an interrupted write never
+        # leaves a partial entry behind
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(artifacts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None):
+        """
+        Removes least recently used entries until the total size of the cache
+        is at most max_bytes.
+
+        Parameters:
+        - keep: Key of an entry that should not be removed even if it alone
+            exceeds max_bytes, e.g. the entry that was just stored
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        keep_path = self._entry_path(keep) if keep is not None else None
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            os.remove(path)
+            total_bytes -= size
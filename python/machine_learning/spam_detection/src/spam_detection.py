@@ -45,16 +45,132 @@ The function should return a triple consisting of
 """
 
 import gzip
-from typing import List
+import itertools
+import json
+import os
+import time
+from typing import Iterator, List, Tuple, Union
 
 import numpy as np
+import scipy.sparse
 import sklearn
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
 from sklearn import metrics
 from sklearn.model_selection import train_test_split
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import make_pipeline
 
+from spam_cache import ArtifactCache
+from spam_tokens import TokenizedCorpus, tokenize_corpus
+
+
+HAM_PATH = "src/ham.txt.gz"
+SPAM_PATH = "src/spam.txt.gz"
+
+# Version of the artifacts stored in the cache by spam_detection. Increment it
+# when the stored artifacts change, so that older entries are not reused.
+ARTIFACTS_VERSION = 2
+ARTIFACT_NAMES = {"features_1", "labels_1", "model_1", "labels_1_test",
+                  "labels_1_pred", "model_2", "labels_2_test",
+                  "labels_2_pred"}
+
+
+def clip_fraction(fraction: float) -> float:
+    """
+    Constricts fraction to the range [0.0, 1.0].
+
+    Parameters:
+    - fraction (float): Fraction of a dataset
+
+    Returns:
+    - fraction: The fraction clipped to the range [0.0, 1.0]
+    """
+    return min(max(fraction, 0.0), 1.0)
+
+
+def count_lines(path: str) -> int:
+    """
+    Counts the lines in a gzip-compressed file.
+
+    Counting requires decompressing the whole file, so the count is stored in a
+    small sidecar index file next to the data file (path + ".lines.json") and
+    reused for as long as the size and modification time of the data file stay
+    the same.
+
+    Parameters:
+    - path: Path to the gzip-compressed file
+
+    Returns:
+    - line_count: Number of lines in the decompressed file
+    """
+    index_path = path + ".lines.json"
+    stat = os.stat(path)
+
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["size"] == stat.st_size and \
+                index["mtime_ns"] == stat.st_mtime_ns:
+            return index["lines"]
+
+    with gzip.open(path) as f:
+        line_count = sum(1 for _ in f)
+
+    # The index is only an optimization, so e.g. a read-only checkout just
+    # goes without it
+    try:
+        with open(index_path, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                       "lines": line_count}, f)
+    except OSError:
+        pass
+
+    return line_count
+
+
+def iter_lines(path: str, fraction: float = 1.0) -> Iterator[bytes]:
+    """
+    Yields a fraction of the lines in a gzip-compressed file, counting from the
+    beginning of the file.
+
+    Decompression stops once the requested fraction of lines has been read, so
+    the rest of the file is never decompressed or held in memory.
+
+    Parameters:
+    - path: Path to the gzip-compressed file
+    - fraction: Fraction of lines to yield, clipped to the range [0.0, 1.0]
+
+    Returns:
+    - Iterator over the lines as bytes
+    """
+    line_limit = int(count_lines(path) * clip_fraction(fraction))
+
+    with gzip.open(path) as f:
+        yield from itertools.islice(f, line_limit)
+
+
+def iter_chunks(path: str, fraction: float = 1.0, chunk_size: int = 1000) \
+        -> Iterator[List[bytes]]:
+    """
+    Yields a fraction of the lines in a gzip-compressed file in lists of
+    chunk_size lines, e.g. for vectorizing the data in batches.
+
+    Parameters:
+    - path: Path to the gzip-compressed file
+    - fraction: Fraction of lines to yield, clipped to the range [0.0, 1.0]
+    - chunk_size: Number of lines per chunk. The last chunk may be smaller.
+
+    Returns:
+    - Iterator over lists of lines as bytes
+    """
+    lines = iter_lines(path, fraction)
+
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 
 def load_data(fraction: float) -> (List[str], List[str]):
     """
@@ -71,28 +187,16 @@ def load_data(fraction: float) -> (List[str], List[str]):
     - spam_data_fraction: Fraction of the full spam dataset counting from the
       beginning of the source data file
     """
-
-    with gzip.open("src/ham.txt.gz") as f:
-        ham_data = f.readlines()
-
-    with gzip.open("src/spam.txt.gz") as f:
-        spam_data = f.readlines()
-
-    if fraction > 1.0:
-        fraction = 1.0
-
-    if fraction < 0.0:
-        fraction = 0.0
-
-    # Constrict to length determined by fraction param
-    ham_data_fraction = ham_data[:int(len(ham_data) * fraction)]
-    spam_data_fraction = spam_data[:int(len(spam_data) * fraction)]
+    ham_data_fraction = list(iter_lines(HAM_PATH, fraction))
+    spam_data_fraction = list(iter_lines(SPAM_PATH, fraction))
 
     return ham_data_fraction, spam_data_fraction
 
 
-def get_features_and_labels(ham_list: List[str], spam_list: List[str]) \
-        -> (np.array, np.array):
+def get_features_and_labels(ham_list: List[str], spam_list: List[str],
+                            sparse: bool = False,
+                            corpus: TokenizedCorpus = None) \
+        -> (Union[np.array, scipy.sparse.csr_matrix], np.array):
     """
     Create numpy arrays for features and labels by vectorizing and combining
     the ham and spam datasets
@@ -100,26 +204,85 @@ def get_features_and_labels(ham_list: List[str], spam_list: List[str]) \
     Parameters:
     - ham_list: list of ham email contents as strings
     - spam_list: list of spam email contents as strings
+    - sparse: If True, the features are returned as the CSR matrix produced by
+        CountVectorizer. The dense array has one float64 cell per vocabulary
+        word per email, which on the full corpus takes gigabytes of memory.
 
     Returns:
     - features: Word count vectorization of the combined ham and spam datasets
-        as Numpy array
+        as Numpy array, or as Scipy CSR matrix if sparse is True
     - labels: Corresponding labels for each row in features, label 0 for ham and
         1 for span
     """
-    vec = CountVectorizer()
-
-    all_list = ham_list + spam_list
     ham_labels = np.zeros(len(ham_list))
     spam_labels = np.ones(len(spam_list))
 
-    features = vec.fit_transform(all_list).toarray()
+    if corpus is None:
+        vec = CountVectorizer()
+        features = vec.fit_transform(ham_list + spam_list)
+    else:
+        features = corpus.count_matrix()
+
+    if not sparse:
+        features = features.toarray()
     labels = np.concatenate((ham_labels, spam_labels))
 
     return features, labels
 
 
-def spam_detection(random_state: int = 0, fraction: float = 1.0) \
+def write_diagnostics_report(path: str, data_test: List[bytes],
+                             labels_test: np.array, labels_1_pred: np.array,
+                             labels_2_pred: np.array) -> (int, int):
+    """
+    Writes the test emails that only one of the two methods of spam_detection
+    misclassifies to a tab-separated file.
+
+    Both methods use the same train-test split, as train_test_split shuffles
+    by random_state and the number of emails only, so the test rows of the two
+    methods correspond to each other.
+
+    Parameters:
+    - path: Path of the report file to write
+    - data_test: Test set emails
+    - labels_test: Real labels of the test set emails
+    - labels_1_pred: Labels predicted by method 1
+    - labels_2_pred: Labels predicted by method 2
+
+    Returns:
+    - only_1_count: Number of emails misclassified only by method 1
+    - only_2_count: Number of emails misclassified only by method 2
+    """
+    misclassified_1 = labels_1_pred != labels_test
+    misclassified_2 = labels_2_pred != labels_test
+
+    only_1_idx = np.flatnonzero(misclassified_1 & np.invert(misclassified_2))
+    only_2_idx = np.flatnonzero(misclassified_2 & np.invert(misclassified_1))
+
+    differing_idx = np.concatenate((only_1_idx, only_2_idx))
+    misclassified_by = np.repeat([1, 2], [len(only_1_idx), len(only_2_idx)])
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("test_index\tmisclassified_by\tlabel\tpred_1\tpred_2\t"
+                "message\n")
+        for idx, method in zip(differing_idx, misclassified_by):
+            message = data_test[idx]
+            if isinstance(message, bytes):
+                message = message.decode("utf-8", errors="replace")
+            message = message.strip().replace("\t", " ")
+
+            f.write(f"{idx}\t{method}\t{int(labels_test[idx])}\t"
+                    f"{int(labels_1_pred[idx])}\t{int(labels_2_pred[idx])}\t"
+                    f"{message}\n")
+
+    print(f"{len(only_1_idx)} emails misclassified only by method 1, "
+          f"{len(only_2_idx)} only by method 2, written to {path}")
+
+    return len(only_1_idx), len(only_2_idx)
+
+
+def spam_detection(random_state: int = 0, fraction: float = 1.0,
+                   sparse: bool = False, cache: ArtifactCache = None,
+                   diagnostics_path: str = None, n_jobs: int = None) \
         -> (float, int, int):
     """
     Trains a multinomial Naive Bayes model to detect spam emails.
@@ -128,14 +291,28 @@ def spam_detection(random_state: int = 0, fraction: float = 1.0) \
     vectorization separately from model training, method 2 uses a single
     scikit-learn pipeline for both vectorization and model training. Curiously,
     method 2 does better when fraction=0.1, but slightly worse when using the
-    full dataset. There are some commented lines for analysis of the difference,
-    but nothing conclusive.
+    full dataset. The emails misclassified by only one of the methods can be
+    exported for analysis of the difference with diagnostics_path, but nothing
+    conclusive has been found.
 
     Parameters:
     - random_state: Seed for random values, used for deterministic
         train-test split
     - fraction: Fraction of spam and ham datasets to use in model training.
         Used to limit the dataset size for resource constrained infrastructure
+    - sparse: Keep the method 1 feature matrix in CSR format through
+        train_test_split and MultinomialNB fit and predict instead of
+        converting it to a dense array. The results are the same.
+    - cache: Optional artifact cache. The feature matrix, the fitted models and
+        their predictions are stored in the cache, keyed by the contents of the
+        source data files, fraction, random_state and ARTIFACTS_VERSION, and
+        reused on later runs instead of fitting the models again.
+    - diagnostics_path: If given, a report of the test emails misclassified by
+        only one of the two methods is written to this path, see
+        write_diagnostics_report. Disabled by default.
+    - n_jobs: Number of processes to tokenize the emails with, by default the
+        number of CPUs. The emails are tokenized once with tokenize_corpus and
+        both methods count their features from the same tokens.
 
     Returns:
     - acc_1: Accuracy of model trained with method 1 described above
@@ -143,19 +320,85 @@ def spam_detection(random_state: int = 0, fraction: float = 1.0) \
     - misclassified_1: Number of misclassified emails with method 1
     """
 
-    ham_data, spam_data = load_data(fraction)
-
-    # METHOD 1: With count vectorization separately
-    # This returns the result expected by tests
-    features_1, labels_1 = get_features_and_labels(ham_data, spam_data)
-
-    features_1_train, features_1_test, labels_1_train, labels_1_test = \
-        train_test_split(features_1, labels_1, train_size=0.75,
-                         random_state=random_state)
-
-    model_1 = MultinomialNB()
-    model_1.fit(features_1_train, labels_1_train)
-    labels_1_pred = model_1.predict(features_1_test)
+    artifacts = None
+    if cache is not None:
+        cache_key = cache.key([HAM_PATH, SPAM_PATH],
+                              fraction=clip_fraction(fraction),
+                              random_state=random_state,
+                              version=ARTIFACTS_VERSION)
+        artifacts = cache.get(cache_key)
+
+        # Entries written by older code may lack artifacts that are used now
+        if artifacts is not None and not ARTIFACT_NAMES <= artifacts.keys():
+            artifacts = None
+
+    # The raw data is only needed for training and for the diagnostics report
+    if artifacts is None or diagnostics_path is not None:
+        ham_data, spam_data = load_data(fraction)
+
+        # Data and labels for method 2
+        ham_labels = [0 for mail in ham_data]
+        spam_labels = [1 for mail in spam_data]
+
+        data_2 = ham_data + spam_data
+        labels_2 = ham_labels + spam_labels
+
+        data_2_train, data_2_test, labels_2_train, labels_2_test = \
+            train_test_split(data_2, labels_2, train_size=0.75,
+                             random_state=random_state)
+
+    if artifacts is None:
+        corpus = tokenize_corpus(data_2, n_jobs=n_jobs)
+
+        # METHOD 1: With count vectorization separately
+        # This returns the result expected by tests
+        features_1, labels_1 = get_features_and_labels(
+            ham_data, spam_data, sparse=sparse, corpus=corpus)
+
+        features_1_train, features_1_test, labels_1_train, labels_1_test = \
+            train_test_split(features_1, labels_1, train_size=0.75,
+                             random_state=random_state)
+
+        model_1 = MultinomialNB()
+        model_1.fit(features_1_train, labels_1_train)
+
+        # METHOD 2: With count vectorization and MultinomialNB in one pipeline
+        # This returns a better result than expected by the tests
+        #
+        # Fitting the pipeline would tokenize the training emails again, so
+        # the counts are taken from the shared tokens instead. The vocabulary
+        # is learned from the training emails only, as the pipeline would do,
+        # and set on the pipeline's CountVectorizer for later use.
+        rows_2_train, rows_2_test = train_test_split(
+            np.arange(len(data_2)), train_size=0.75,
+            random_state=random_state)
+        term_ids_2 = corpus.term_ids(rows_2_train)
+
+        model_2 = make_pipeline(
+            CountVectorizer(vocabulary=corpus.vocabulary(term_ids_2)),
+            MultinomialNB())
+        model_2.steps[0][1].fit([])
+        model_2.steps[-1][1].fit(
+            corpus.count_matrix(rows_2_train, term_ids_2), labels_2_train)
+
+        artifacts = {
+            "features_1": scipy.sparse.csr_matrix(features_1),
+            "labels_1": labels_1,
+            "model_1": model_1,
+            "labels_1_test": labels_1_test,
+            "labels_1_pred": model_1.predict(features_1_test),
+            "model_2": model_2,
+            "labels_2_test": np.array(labels_2_test),
+            "labels_2_pred": model_2.steps[-1][1].predict(
+                corpus.count_matrix(rows_2_test, term_ids_2))
+        }
+
+        if cache is not None:
+            cache.put(cache_key, artifacts)
+
+    # Evaluate method 1
+    labels_1_test = artifacts["labels_1_test"]
+    labels_1_pred = artifacts["labels_1_pred"]
 
     acc_1 = metrics.accuracy_score(labels_1_pred, labels_1_test)
     labels_1_test_size = len(labels_1_test)
@@ -163,22 +406,9 @@ def spam_detection(random_state: int = 0, fraction: float = 1.0) \
 
     print(acc_1, labels_1_test_size, misclassified_1.sum())
 
-    # METHOD 2: With count vectorization and MultinomialNB in one pipeline
-    ham_labels = [0 for mail in ham_data]
-    spam_labels = [1 for mail in spam_data]
-
-    # This returns a better result than expected by the tests
-    data_2 = ham_data + spam_data
-    labels_2 = ham_labels + spam_labels
-
-    data_2_train, data_2_test, labels_2_train, labels_2_test = \
-        train_test_split(data_2, labels_2, train_size=0.75,
-                         random_state=random_state)
-    model = make_pipeline(CountVectorizer(), MultinomialNB())
-
-    model.fit(data_2_train, labels_2_train)
-    labels_2_pred = model.predict(data_2_test)
-    labels_2_test = np.array(labels_2_test)
+    # Evaluate method 2
+    labels_2_test = artifacts["labels_2_test"]
+    labels_2_pred = artifacts["labels_2_pred"]
 
     acc_2 = metrics.accuracy_score(labels_2_pred, labels_2_test)
     labels_2_test_size = len(labels_2_test)
@@ -187,28 +417,134 @@ def spam_detection(random_state: int = 0, fraction: float = 1.0) \
     print(acc_2, labels_2_test_size, misclassified_2.sum())
 
     # Analysis of difference
-    miscl_data_1_idx = [i for i in range(
-        len(data_2_test)) if list(misclassified_1)[i]]
-    miscl_data_2_idx = [i for i in range(
-        len(data_2_test)) if list(misclassified_2)[i]]
-    difference = list(set(miscl_data_1_idx) - set(miscl_data_2_idx))
-
-    print(miscl_data_1_idx)
-    print(miscl_data_2_idx)
-    print(difference)
-
-    for msg_idx in difference:
-        print(
-            data_2[msg_idx],
-            int(labels_1_pred[msg_idx]),
-            labels_2_pred[msg_idx],
-            int(labels_1_test[msg_idx]),
-            labels_2_test[msg_idx]
-        )
+    if diagnostics_path is not None:
+        write_diagnostics_report(diagnostics_path, data_2_test, labels_2_test,
+                                 labels_1_pred, labels_2_pred)
 
     return acc_1, labels_1_test_size, misclassified_1.sum()
 
 
+def iter_labeled_batches(fraction: float, batch_size: int, random_state: int,
+                         train_size: float = 0.75) \
+        -> Iterator[Tuple[List[bytes], np.array, np.array]]:
+    """
+    Streams batches of ham and spam emails together with their labels and a
+    random train-test assignment for each email.
+
+    The train-test assignment is drawn from a random generator seeded with
+    random_state, so iterating again with the same parameters gives exactly the
+    same assignment without having to store it.
+
+    Parameters:
+    - fraction: Fraction of the ham and spam datasets to stream
+    - batch_size: Number of emails per batch
+    - random_state: Seed for the train-test assignment
+    - train_size: Probability of an email being assigned to the training set
+
+    Returns:
+    - Iterator over triples of a batch of emails, their labels (0 for ham and 1
+        for spam) and a boolean mask that is True for the test set emails
+    """
+    rng = np.random.RandomState(random_state)
+
+    for path, label in ((HAM_PATH, 0), (SPAM_PATH, 1)):
+        for batch in iter_chunks(path, fraction, batch_size):
+            labels = np.full(len(batch), label)
+            test_mask = rng.random_sample(len(batch)) >= train_size
+            yield batch, labels, test_mask
+
+
+def spam_detection_incremental(random_state: int = 0, fraction: float = 1.0,
+                               batch_size: int = 1000,
+                               n_features: int = 2**20) \
+        -> (float, int, int, float):
+    """
+    Trains a multinomial Naive Bayes model to detect spam emails out of core.
+
+    The emails are streamed from the gzip files in batches and hashed into a
+    fixed number of features with HashingVectorizer (raw counts, no
+    normalization), so no vocabulary needs to be built and memory use does not
+    grow with the corpus. The model is updated batch by batch with
+    MultinomialNB.partial_fit. As Naive Bayes only sums word counts per class,
+    the result does not depend on the batch size.
+
+    The test set is a random 25% of the emails. It is scored on a second pass
+    over the data once training is finished.
+
+    Parameters:
+    - random_state: Seed for the random train-test assignment
+    - fraction: Fraction of spam and ham datasets to use
+    - batch_size: Number of emails to stream at a time
+    - n_features: Number of hashed features. Collisions become more likely
+        with fewer features.
+
+    Returns:
+    - acc: Accuracy of the model on the test set, NaN if the training or the
+        test set is empty
+    - test_size: Size of the test set
+    - misclassified: Number of misclassified emails in the test set
+    - train_throughput: Training throughput in emails trained on per second,
+        including reading, decompression and vectorization
+    """
+    vec = HashingVectorizer(n_features=n_features, alternate_sign=False,
+                            norm=None)
+    model = MultinomialNB()
+
+    # Training pass
+    train_emails = 0
+    start = time.perf_counter()
+
+    for batch, labels, test_mask in iter_labeled_batches(
+            fraction, batch_size, random_state):
+        train_mask = np.invert(test_mask)
+        if not train_mask.any():
+            continue
+
+        # Hash only the training emails, the test emails are scored later
+        features = vec.transform(
+            [email for email, train in zip(batch, train_mask) if train])
+        model.partial_fit(features, labels[train_mask],
+                          classes=[0, 1])
+        train_emails += int(train_mask.sum())
+
+    train_seconds = time.perf_counter() - start
+
+    # Scoring pass. If no email was assigned to the training set, the model
+    # was never fitted, and only the test set is counted.
+    fitted = train_emails > 0
+    scored_emails = 0
+    test_size = 0
+    misclassified = 0
+    start = time.perf_counter()
+
+    for batch, labels, test_mask in iter_labeled_batches(
+            fraction, batch_size, random_state):
+        scored_emails += len(batch)
+        if not test_mask.any():
+            continue
+
+        test_size += test_mask.sum()
+        if fitted:
+            features = vec.transform(
+                [email for email, test in zip(batch, test_mask) if test])
+            labels_pred = model.predict(features)
+            misclassified += (labels_pred != labels[test_mask]).sum()
+
+    test_seconds = time.perf_counter() - start
+
+    acc = float(1 - misclassified / test_size) if fitted and test_size > 0 \
+        else float("nan")
+    train_throughput = train_emails / train_seconds
+
+    print(f"Training: {train_emails} emails trained on in "
+          f"{train_seconds:.2f} s, {train_throughput:.0f} emails/s")
+    print(f"Scoring: {scored_emails} emails streamed, {test_size} scored in "
+          f"{test_seconds:.2f} s, {scored_emails / test_seconds:.0f} "
+          f"emails/s")
+
+    return acc, int(test_size), int(misclassified), train_throughput
+
+
 def main():
     """
     Main function, runs spam classification training.
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the spam detection exercise.
+
+Run from the spam_detection folder like the exercise itself, so that the
+relative paths to the source data in src resolve:
+
+    python src/spam_detection_benchmark.py
+"""
+
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+
+from spam_detection import get_features_and_labels, load_data
+from spam_scorer import SpamScorer
+
+
+def measure(func: Callable, *args, **kwargs) -> Tuple[object, float, int]:
+    """
+    Runs a function once and measures its wall clock time and peak memory
+    allocation.
+
+    Parameters:
+    - func: Function to measure
+    - args, kwargs: Arguments passed on to func
+
+    Returns:
+    - result: Return value of func
+    - seconds: Wall clock time of the call in seconds
+    - peak_bytes: Peak memory allocated during the call as traced by
+        tracemalloc
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, seconds, peak_bytes
+
+
+def run_feature_path(ham_data: list, spam_data: list, sparse: bool) -> float:
+    """
+    Runs the method 1 path of spam_detection: vectorization, train-test split,
+    MultinomialNB fit and predict.
+
+    Parameters:
+    - ham_data: List of ham emails
+    - spam_data: List of spam emails
+    - sparse: Whether to keep the features in CSR format
+
+    Returns:
+    - accuracy: Accuracy of the prediction on the test set
+    """
+    features, labels = get_features_and_labels(
+        ham_data, spam_data, sparse=sparse)
+
+    features_train, features_test, labels_train, labels_test = \
+        train_test_split(features, labels, train_size=0.75, random_state=0)
+
+    model = MultinomialNB()
+    model.fit(features_train, labels_train)
+
+    return (model.predict(features_test) == labels_test).mean()
+
+
+def benchmark_feature_paths(fractions: tuple = (0.1, 0.5, 1.0)) \
+        -> pd.DataFrame:
+    """
+    Compares the dense and the sparse feature paths of spam_detection in
+    terms of time, peak memory and throughput.
+
+    Parameters:
+    - fractions: Fractions of the dataset to benchmark with
+
+    Returns:
+    - result_df: DataFrame with one row per fraction and feature path
+    """
+    rows = []
+
+    for fraction in fractions:
+        ham_data, spam_data = load_data(fraction)
+        emails = len(ham_data) + len(spam_data)
+
+        for sparse in (False, True):
+            accuracy, seconds, peak_bytes = measure(
+                run_feature_path, ham_data, spam_data, sparse)
+
+            rows.append({
+                "fraction": fraction,
+                "path": "sparse" if sparse else "dense",
+                "emails": emails,
+                "accuracy": accuracy,
+                "seconds": seconds,
+                "peak_mb": peak_bytes / 2**20,
+                "emails_per_s": emails / seconds
+            })
+
+    return pd.DataFrame(rows)
+
+
+def benchmark_scorer(batch_sizes: tuple = (1, 64, 4096), repeats: int = 50,
+                     random_state: int = 0) -> pd.DataFrame:
+    """
+    Measures the latency of classifying batches of emails with SpamScorer.
+
+    Batches are sampled with replacement from the corpus. Batches are
+    classified with SpamScorer.predict, and batches of size 1 also with the
+    single email fast path SpamScorer.predict_one.
+
+    Parameters:
+    - batch_sizes: Batch sizes to benchmark
+    - repeats: Number of batches to classify per batch size
+    - random_state: Seed for sampling the batches
+
+    Returns:
+    - result_df: DataFrame with p50 and p99 latency per batch and per email
+    """
+    scorer = SpamScorer.fit()
+    ham_data, spam_data = load_data(1.0)
+    emails = ham_data + spam_data
+    rng = np.random.RandomState(random_state)
+
+    def latencies(score_batch: Callable, batch_size: int) -> np.array:
+        seconds = np.empty(repeats)
+        for i in range(repeats):
+            batch = [emails[j]
+                     for j in rng.randint(len(emails), size=batch_size)]
+            start = time.perf_counter()
+            score_batch(batch)
+            seconds[i] = time.perf_counter() - start
+        return seconds
+
+    rows = []
+    for batch_size in batch_sizes:
+        paths = [("predict", scorer.predict)]
+        if batch_size == 1:
+            paths.append(
+                ("predict_one", lambda batch: scorer.predict_one(batch[0])))
+
+        for path, score_batch in paths:
+            seconds = latencies(score_batch, batch_size)
+            p50, p99 = np.percentile(seconds, [50, 99])
+            rows.append({
+                "batch_size": batch_size,
+                "path": path,
+                "p50_ms": p50 * 1000,
+                "p99_ms": p99 * 1000,
+                "p50_ms_per_email": p50 * 1000 / batch_size,
+                "emails_per_s": batch_size / p50
+            })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    """
+    Main function, runs the benchmarks and prints the results.
+    """
+    print(benchmark_feature_paths())
+    print(benchmark_scorer())
+
+
+if __name__ == "__main__":
+    main()
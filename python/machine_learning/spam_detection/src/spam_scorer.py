@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+Scoring API for the spam detection model.
+
+SpamScorer wraps a trained CountVectorizer + MultinomialNB pipeline, as created
+by method 2 of spam_detection, so that new emails can be classified without
+retraining. Lists of emails are classified in vectorized batches through the
+pipeline. Single emails can be classified with a fast path that skips the
+scikit-learn machinery and sums precomputed log-probabilities of the words in
+the email directly.
+"""
+
+import pickle
+from typing import List
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline, make_pipeline
+
+from spam_detection import load_data
+
+
+class SpamScorer:
+    """
+    Classifies raw emails as ham (0) or spam (1) with a trained pipeline.
+
+    Parameters:
+    - pipeline: Fitted scikit-learn pipeline whose first step is a
+        CountVectorizer and last step a MultinomialNB model
+    """
+
+    def __init__(self, pipeline: Pipeline):
+        self.pipeline = pipeline
+
+        vectorizer = pipeline.steps[0][1]
+        model = pipeline.steps[-1][1]
+
+        # Precompute everything the single email fast path needs
+        self._analyzer = vectorizer.build_analyzer()
+        self._vocabulary = vectorizer.vocabulary_
+        self._class_log_prior = model.class_log_prior_
+
+        # Stored as (n_words, n_classes), so that the log-probabilities of one
+        # word are contiguous in memory
+        self._feature_log_prob = np.ascontiguousarray(
+            model.feature_log_prob_.T)
+
+        self.classes_ = model.classes_
+
+    @classmethod
+    def fit(cls, fraction: float = 1.0) -> "SpamScorer":
+        """
+        Trains a new pipeline on the ham and spam datasets.
+
+        Parameters:
+        - fraction: Fraction of the ham and spam datasets to train on
+
+        Returns:
+        - scorer: SpamScorer using the trained pipeline
+        """
+        ham_data, spam_data = load_data(fraction)
+        labels = [0] * len(ham_data) + [1] * len(spam_data)
+
+        pipeline = make_pipeline(CountVectorizer(), MultinomialNB())
+        pipeline.fit(ham_data + spam_data, labels)
+
+        return cls(pipeline)
+
+    @classmethod
+    def load(cls, path: str) -> "SpamScorer":
+        """
+        Loads a pipeline saved with SpamScorer.save.
+
+        Parameters:
+        - path: Path to the pickled pipeline
+
+        Returns:
+        - scorer: SpamScorer using the loaded pipeline
+        """
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+    def save(self, path: str):
+        """
+        Saves the pipeline of the scorer.
+
+        Parameters:
+        - path: Path to write the pickled pipeline to
+        """
+        with open(path, "wb") as f:
+            pickle.dump(self.pipeline, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def predict(self, emails: List[str], batch_size: int = 4096) -> np.array:
+        """
+        Classifies a list of emails.
+
+        The emails are vectorized and classified batch_size emails at a time,
+        which bounds the size of the intermediate count matrix.
+
+        Parameters:
+        - emails: List of raw emails as strings or bytes
+        - batch_size: Number of emails to classify at a time
+
+        Returns:
+        - labels: Numpy array of predicted labels, 0 for ham and 1 for spam
+        """
+        if len(emails) == 0:
+            return np.empty(0, dtype=self.classes_.dtype)
+
+        return np.concatenate([
+            self.pipeline.predict(emails[start:start + batch_size])
+            for start in range(0, len(emails), batch_size)
+        ])
+
+    def predict_one(self, email: str) -> int:
+        """
+        Classifies a single email.
+
+        The joint log-likelihood of each class is the class log prior plus the
+        dot product of the email's word counts with the class's word
+        log-probabilities. As the count vector is sparse, the dot product is
+        computed by summing the log-probability rows of the words in the email,
+        which gives the same result as the pipeline without its overhead.
+
+        Parameters:
+        - email: Raw email as string or bytes
+
+        Returns:
+        - label: Predicted label, 0 for ham and 1 for spam
+        """
+        vocabulary = self._vocabulary
+        word_ids = [vocabulary[word] for word in self._analyzer(email)
+                    if word in vocabulary]
+
+        joint_log_likelihood = self._class_log_prior + \
+            self._feature_log_prob[word_ids].sum(axis=0)
+
+        return self.classes_[np.argmax(joint_log_likelihood)]
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+Parallel evaluation of spam detection over several random states and
+fractions.
+
+To evaluate the stability of the model, method 1 of spam_detection is run with
+many combinations of random_state and fraction. Reading and vectorizing the
+corpus is the same for every run, so it is done only once. The resulting CSR
+feature matrix is placed in shared memory, from which the worker processes use
+it without copying. The workers only do the train-test split, the model fit and
+the scoring.
+
+The vocabulary is fitted on the largest fraction in the sweep. For smaller
+fractions, the columns of the words that do not occur in the selected emails
+are dropped before fitting, since the extra all-zero columns would change the
+smoothed word probabilities of MultinomialNB. The results are then the same as
+running spam_detection with that fraction.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+
+from spam_detection import (HAM_PATH, SPAM_PATH, clip_fraction, count_lines,
+                            get_features_and_labels, load_data)
+from spam_tokens import tokenize_corpus
+
+
+# State of a worker process, set up by _init_worker
+_worker = {}
+
+
+def share_array(a: np.array) -> Tuple[shared_memory.SharedMemory, tuple]:
+    """
+    Copies a Numpy array to a new shared memory block.
+
+    Parameters:
+    - a: Numpy array to share
+
+    Returns:
+    - shm: The shared memory block. The caller is responsible for closing and
+        unlinking it.
+    - spec: Tuple of block name, shape and dtype with which other processes
+        can attach to the array with attach_array
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+    shared = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+    shared[:] = a
+
+    return shm, (shm.name, a.shape, a.dtype.str)
+
+
+def attach_array(spec: tuple) -> Tuple[shared_memory.SharedMemory, np.array]:
+    """
+    Attaches to an array shared with share_array without copying it.
+
+    Parameters:
+    - spec: Specification returned by share_array
+
+    Returns:
+    - shm: The shared memory block, which needs to be kept referenced for as
+        long as the array is used
+    - a: Numpy array backed by the shared memory block
+    """
+    name, shape, dtype = spec
+
+    try:
+        # Python 3.13+: the creating process alone is responsible for cleanup
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker(csr_specs: List[tuple], shape: tuple, labels: np.array,
+                 n_ham: int, line_counts: Tuple[int, int]):
+    """
+    Attaches a worker process to the shared feature matrix.
+    """
+    blocks, arrays = zip(*[attach_array(spec) for spec in csr_specs])
+
+    _worker["blocks"] = blocks
+    _worker["features"] = scipy.sparse.csr_matrix(arrays, shape=shape,
+                                                  copy=False)
+    _worker["labels"] = labels
+    _worker["n_ham"] = n_ham
+    _worker["line_counts"] = line_counts
+
+
+def _evaluate(random_state: int, fraction: float) -> dict:
+    """
+    Evaluates method 1 of spam_detection in a worker process with the shared
+    feature matrix.
+    """
+    start = time.perf_counter()
+
+    # Take fraction of the full ham and spam datasets from the start of the
+    # loaded rows, in the same way as load_data. The loaded rows only cover
+    # the largest fraction of the sweep, so the row counts are computed from
+    # the line counts of the data files.
+    features = _worker["features"]
+    labels = _worker["labels"]
+    n_ham = _worker["n_ham"]
+    n_spam = labels.shape[0] - n_ham
+    ham_lines, spam_lines = _worker["line_counts"]
+
+    n_ham_rows = int(ham_lines * clip_fraction(fraction))
+    n_spam_rows = int(spam_lines * clip_fraction(fraction))
+
+    if n_ham_rows < n_ham or n_spam_rows < n_spam:
+        rows = np.concatenate((np.arange(n_ham_rows),
+                               n_ham + np.arange(n_spam_rows)))
+        features = features[rows]
+        labels = labels[rows]
+
+        # Keep only the vocabulary of the selected emails, as spam_detection
+        # would have fitted it. The columns stay in vocabulary order.
+        features = features[:, np.unique(features.indices)]
+
+    features_train, features_test, labels_train, labels_test = \
+        train_test_split(features, labels, train_size=0.75,
+                         random_state=random_state)
+    split_done = time.perf_counter()
+
+    model = MultinomialNB()
+    model.fit(features_train, labels_train)
+    fit_done = time.perf_counter()
+
+    labels_pred = model.predict(features_test)
+    misclassified = (labels_pred != labels_test).sum()
+    predict_done = time.perf_counter()
+
+    return {
+        "random_state": random_state,
+        "fraction": fraction,
+        "accuracy": 1 - misclassified / labels_test.shape[0],
+        "test_size": labels_test.shape[0],
+        "misclassified": misclassified,
+        "split_s": split_done - start,
+        "fit_s": fit_done - split_done,
+        "predict_s": predict_done - fit_done,
+        "total_s": predict_done - start,
+        "pid": os.getpid()
+    }
+
+
+def spam_sweep(random_states: List[int], fractions: List[float],
+               n_jobs: int = None) -> pd.DataFrame:
+    """
+    Evaluates method 1 of spam_detection for every combination of random state
+    and fraction in parallel.
+
+    Parameters:
+    - random_states: Random states to pass on to train_test_split
+    - fractions: Fractions of the ham and spam datasets to evaluate with
+    - n_jobs: Number of worker processes for tokenization and evaluation, by
+        default the number of CPUs
+
+    Returns:
+    - result_df: DataFrame with one row per combination, with the accuracy,
+        test set size, number of misclassified emails and the time spent on
+        split, fit and prediction
+    """
+    start = time.perf_counter()
+
+    ham_data, spam_data = load_data(max(fractions))
+    line_counts = (count_lines(HAM_PATH), count_lines(SPAM_PATH))
+    corpus = tokenize_corpus(ham_data + spam_data, n_jobs=n_jobs)
+    features, labels = get_features_and_labels(
+        ham_data, spam_data, sparse=True, corpus=corpus)
+    vectorize_seconds = time.perf_counter() - start
+
+    blocks, specs = zip(*[share_array(a) for a in
+                          (features.data, features.indices, features.indptr)])
+
+    try:
+        with ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=_init_worker,
+                initargs=(specs, features.shape, labels, len(ham_data),
+                          line_counts)) as executor:
+            combinations = list(product(random_states, fractions))
+            results = list(executor.map(_evaluate, *zip(*combinations)))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    result_df = pd.DataFrame(results)
+    print(f"Vectorized {features.shape[0]} emails once in "
+          f"{vectorize_seconds:.2f} s, evaluated {len(results)} runs in "
+          f"{time.perf_counter() - start - vectorize_seconds:.2f} s")
+
+    return result_df
+
+
+def main():
+    """
+    Main function, runs a sweep over random states and fractions.
+    """
+    result_df = spam_sweep(random_states=range(10),
+                           fractions=[0.1, 0.25, 0.5, 1.0])
+    print(result_df)
+    print(result_df.groupby("fraction")["accuracy"].describe())
+
+
+if __name__ == "__main__":
+    main()
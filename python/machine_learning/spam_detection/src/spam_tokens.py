@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""
+Shared tokenization layer for the spam detection models.
+
+Both methods of spam_detection tokenize the same emails, and method 2
+tokenizes them again inside its pipeline on every fit. Here each email is
+tokenized once, in parallel chunks across processes, with the same analyzer as
+CountVectorizer. The tokens are stored as a single flat array of token ids and
+an array of offsets where each email starts, like the indices and indptr
+arrays of a CSR matrix. Count matrices for any subset of emails and vocabulary
+are then built from these arrays without tokenizing again.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class TokenizedCorpus:
+    """
+    Tokenized emails stored as token id arrays.
+
+    The token ids refer to the alphabetically sorted vocabulary, so that the
+    columns of the count matrices are in the same order as with
+    CountVectorizer.
+
+    Parameters:
+    - token_ids: Flat int32 array of the token ids of all emails
+    - offsets: int64 array of length n_emails + 1. The tokens of email i are
+        token_ids[offsets[i]:offsets[i + 1]].
+    - terms: Numpy array of the vocabulary, term i having token id i
+    """
+
+    def __init__(self, token_ids: np.array, offsets: np.array,
+                 terms: np.array):
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self.terms = terms
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def _gather(self, rows: np.array) -> Tuple[np.array, np.array]:
+        """
+        Returns the token ids of the given emails and the position of the
+        email in rows for each token.
+        """
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+
+        # Position of each token within its email
+        token_row = np.repeat(np.arange(rows.shape[0]), lengths)
+        within = np.arange(token_row.shape[0]) - \
+            np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        return self.token_ids[starts[token_row] + within], token_row
+
+    def term_ids(self, rows: np.array = None) -> np.array:
+        """
+        Returns the ids of the terms that occur in the given emails, i.e. the
+        vocabulary CountVectorizer would learn from them.
+
+        Parameters:
+        - rows: Indices of the emails, by default all emails
+
+        Returns:
+        - term_ids: Sorted array of token ids
+        """
+        if rows is None:
+            return np.unique(self.token_ids)
+
+        return np.unique(self._gather(np.asarray(rows))[0])
+
+    def vocabulary(self, term_ids: np.array = None) -> dict:
+        """
+        Returns a vocabulary in the format of CountVectorizer.vocabulary_.
+
+        Parameters:
+        - term_ids: Token ids to include, by default all terms
+
+        Returns:
+        - vocabulary: Dictionary mapping terms to column indices
+        """
+        terms = self.terms if term_ids is None else self.terms[term_ids]
+        return {term: i for i, term in enumerate(terms)}
+
+    def count_matrix(self, rows: np.array = None,
+                     term_ids: np.array = None) -> scipy.sparse.csr_matrix:
+        """
+        Builds the word count matrix of the given emails, equivalent to the
+        output of CountVectorizer.
+
+        Parameters:
+        - rows: Indices of the emails, one row each, by default all emails
+        - term_ids: Sorted token ids to use as columns, by default all terms.
+            Tokens not in term_ids are ignored, like CountVectorizer.transform
+            ignores words that are not in its vocabulary.
+
+        Returns:
+        - counts: CSR matrix of shape (len(rows), len(term_ids))
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        token_ids, token_row = self._gather(rows)
+
+        if term_ids is None:
+            n_columns = self.terms.shape[0]
+            columns = token_ids
+        else:
+            n_columns = term_ids.shape[0]
+            column_of = np.full(self.terms.shape[0], -1, dtype=np.int64)
+            column_of[term_ids] = np.arange(n_columns)
+            columns = column_of[token_ids]
+
+            known = columns >= 0
+            columns = columns[known]
+            token_row = token_row[known]
+
+        # Duplicate (row, column) entries are summed to counts
+        counts = scipy.sparse.csr_matrix(
+            (np.ones(columns.shape[0], dtype=np.int64),
+             (token_row, columns)),
+            shape=(rows.shape[0], n_columns))
+        counts.sum_duplicates()
+
+        return counts
+
+
+def _tokenize_chunk(docs: list) -> Tuple[List[str], np.array, np.array]:
+    """
+    Tokenizes a chunk of emails in a worker process.
+
+    Returns:
+    - terms: The terms found in the chunk, term i having local id i
+    - token_ids: Flat int32 array of local token ids
+    - lengths: Number of tokens in each email
+    """
+    analyzer = CountVectorizer().build_analyzer()
+    local_ids = {}
+    token_ids = []
+    lengths = np.empty(len(docs), dtype=np.int64)
+
+    for i, doc in enumerate(docs):
+        tokens = analyzer(doc)
+        lengths[i] = len(tokens)
+        token_ids.extend(local_ids.setdefault(token, len(local_ids))
+                         for token in tokens)
+
+    return list(local_ids), np.array(token_ids, dtype=np.int32), lengths
+
+
+def tokenize_corpus(docs: list, n_jobs: int = None,
+                    chunk_size: int = 500) -> TokenizedCorpus:
+    """
+    Tokenizes emails in parallel chunks with the default CountVectorizer
+    analyzer.
+
+    Parameters:
+    - docs: List of emails as strings or bytes
+    - n_jobs: Number of worker processes, by default the number of CPUs, and
+        at most the number of chunks. With n_jobs=1 the emails are tokenized
+        in the calling process.
+    - chunk_size: Number of emails per chunk sent to a worker
+
+    Returns:
+    - corpus: The tokenized emails
+    """
+    chunks = [docs[start:start + chunk_size]
+              for start in range(0, len(docs), chunk_size)]
+
+    # No more workers than chunks, since the pool may start all of its
+    # workers up front
+    n_jobs = min(n_jobs or os.cpu_count(), len(chunks))
+
+    if n_jobs <= 1:
+        results = list(map(_tokenize_chunk, chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_tokenize_chunk, chunks))
+
+    # Merge the local vocabularies of the chunks into a global one
+    global_ids = {}
+    token_id_chunks = []
+    length_chunks = []
+
+    for terms, token_ids, lengths in results:
+        remap = np.array([global_ids.setdefault(term, len(global_ids))
+                          for term in terms], dtype=np.int32)
+        token_id_chunks.append(remap[token_ids] if terms else token_ids)
+        length_chunks.append(lengths)
+
+    # Renumber the terms in alphabetical order, like CountVectorizer
+    terms = np.array(list(global_ids), dtype=object)
+    order = sorted(range(terms.shape[0]), key=terms.__getitem__)
+    rank = np.empty(terms.shape[0], dtype=np.int32)
+    rank[order] = np.arange(terms.shape[0], dtype=np.int32)
+
+    token_ids = rank[np.concatenate(token_id_chunks)] if token_id_chunks \
+        else np.empty(0, dtype=np.int32)
+    offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+    if length_chunks:
+        np.cumsum(np.concatenate(length_chunks), out=offsets[1:])
+
+    return TokenizedCorpus(token_ids, offsets, terms[order])
@@ -0,0 +1,23 @@
+"""
+Tests for spam_sweep. Run from the spam_detection folder:
+
+    python -m pytest src
+"""
+
+from spam_detection import spam_detection
+from spam_sweep import spam_sweep
+
+
+def test_sweep_matches_spam_detection():
+    # The largest fraction is below 1.0, so the sweep loads only part of the
+    # data and the smaller fractions must still be taken of the full data,
+    # with the vocabulary of the selected emails only
+    result_df = spam_sweep(random_states=range(3),
+                           fractions=[0.1, 0.25, 0.5, 0.75], n_jobs=2)
+
+    for row in result_df.itertuples():
+        accuracy, test_size, misclassified = spam_detection(
+            row.random_state, row.fraction)
+        assert row.test_size == test_size
+        assert row.misclassified == misclassified
+        assert row.accuracy == accuracy